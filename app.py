@@ -1,10 +1,48 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, stream_template, request, jsonify, session, redirect, url_for, Response, stream_with_context, abort, make_response, g, flash, has_request_context
+from functools import wraps
+import click
 from flask_sqlalchemy import SQLAlchemy
-from flask_admin import Admin
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import configure_mappers, joinedload
+from flask_admin import Admin, AdminIndexView, BaseView, expose
+from flask_admin.actions import action
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.ajax import QueryAjaxModelLoader
 from flask_admin.menu import MenuLink
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
+from markupsafe import Markup
+from wtforms.validators import ValidationError
 from werkzeug.security import generate_password_hash, check_password_hash
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from decimal import Decimal
+import atexit
+import csv
+import fcntl
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import mmap
 import os
+import re
+import secrets
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import brotli  #optional: enables 'br' response compression
+except ImportError:
+    brotli = None
 
 #initialize Flask app
 app = Flask(__name__)
@@ -12,13 +50,83 @@ app.config['SECRET_KEY'] = 'your-secret-key-here'  #change this to a random secr
 
 #configure SQLAlchemy database
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'enrollment.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'enrollment.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+#the term new courses belong to; older terms can be moved to the archive tables with `flask archive-term`
+app.config['CURRENT_TERM'] = os.environ.get('CURRENT_TERM', 'Fall 2025')
+
+#optional sharded mode: comma-separated database URLs; courses, their meetings and enrollments are
+#partitioned by course id across them (see Sharding), while users and everything else stay in the main database
+app.config['ENROLLMENT_SHARDS'] = [url for url in os.environ.get('ENROLLMENT_SHARDS', '').split(',') if url]
+
+#configure the read cache ('lru' for the in-process cache, 'null' to disable caching)
+app.config['CACHE_BACKEND'] = 'lru'
+app.config['CACHE_MAX_ENTRIES'] = 1024
+app.config['CACHE_TTL'] = 300  #seconds
+app.config['FRAGMENT_CACHE_MAX_ENTRIES'] = 20000  #rendered course rows (two per course)
+app.config['OWNERSHIP_CACHE_MAX_ENTRIES'] = 10000  #course/enrollment -> owning teacher lookups
+app.config['OWNERSHIP_CACHE_TTL'] = 30  #seconds
+app.config['ADMIN_COUNT_CACHE_TTL'] = 60  #seconds an admin list view's row count may be stale
+
+#configure response streaming and compression
+app.config['STREAM_TEMPLATES'] = True
+app.config['STREAM_CHUNK_SIZE'] = 16 * 1024  #bytes of rendered HTML per streamed chunk
+app.config['COMPRESS_RESPONSES'] = True
+app.config['COMPRESS_MIN_SIZE'] = 500  #bytes; smaller bodies are sent as-is
+app.config['COMPRESS_LEVEL'] = 6
+app.config['COMPRESS_MIMETYPES'] = ('text/html', 'application/json', 'text/csv', 'text/css', 'text/javascript')
+
+#configure background jobs
+app.config['JOB_WORKERS'] = 2  #worker threads started with the server; 0 to run jobs only via `flask run-jobs`
+app.config['JOB_POLL_INTERVAL'] = 1.0  #seconds an idle worker sleeps between queue checks
+app.config['JOB_MAX_ATTEMPTS'] = 5
+app.config['JOB_RETRY_DELAY'] = 2.0  #seconds before the first retry, doubled for each later one
+app.config['JOB_RETENTION'] = 24 * 3600  #seconds finished jobs are kept for latency stats
+app.config['JOB_LEASE_TIMEOUT'] = 600  #seconds a running job may go unfinished before it is assumed abandoned
+
+#configure Idempotency-Key handling on write APIs
+app.config['IDEMPOTENCY_TTL'] = 24 * 3600  #seconds a stored response can be replayed
+app.config['IDEMPOTENCY_LOCK_TIMEOUT'] = 30  #seconds before an unfinished claim is treated as abandoned
+
+#configure server-side sessions (see Sessions); lifetime is PERMANENT_SESSION_LIFETIME
+app.config['SESSION_CACHE_MAX_ENTRIES'] = 10000  #sessions held by each process's front cache
+app.config['SESSION_CACHE_TTL'] = 10  #seconds another process's revocation or user edit may take to show
+
+#configure the change-data-capture event log (see Event Log)
+#'batched': buffered in process after commit and appended by a background thread (a crash can lose
+#the last EVENT_FLUSH_INTERVAL seconds); 'strict': written to event_outbox in the write's own
+#transaction and relayed from there, so a committed write always gets its event; 'off': no log
+app.config['EVENT_LOG_MODE'] = os.environ.get('EVENT_LOG_MODE', 'batched')
+app.config['EVENT_LOG_DIR'] = os.environ.get('EVENT_LOG_DIR', os.path.join(basedir, 'events'))
+app.config['EVENT_SEGMENT_BYTES'] = 64 * 1024 * 1024  #a new segment file is started past this size
+app.config['EVENT_BATCH_SIZE'] = 1000  #buffered events that wake the flusher early
+app.config['EVENT_FLUSH_INTERVAL'] = 0.5  #seconds between flushes
+
+#configure the shared seat map (see Seat Map)
+app.config['SEAT_MAP_PATH'] = os.environ.get('SEAT_MAP_PATH')  #default: '<database file>-seats'
+app.config['SEAT_MAP_SLOTS'] = 1 << 18  #course ids below this are tracked (12 bytes each)
+
+#journal mode for file databases; WAL lets readers, writers and online backups run side by side
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'wal')
+
+#configure online backups (see Backup and Restore)
+app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR', os.path.join(basedir, 'backups'))
+app.config['BACKUP_PAGES'] = 1024  #pages copied per step
+app.config['BACKUP_PAUSE'] = 0.005  #seconds the copier sleeps between steps so requests get the disk back
+app.config['BACKUP_MAX_RESTARTS'] = 3  #without WAL: restarts caused by writes before the rest is copied in one step
+
 #initialize database
 db = SQLAlchemy(app)
 
 
+@event.listens_for(Engine, 'connect')
+def set_sqlite_journal_mode(dbapi_connection, connection_record):
+    #the mode is stored in the database file, so this is a no-op after the first connection
+    if isinstance(dbapi_connection, sqlite3.Connection) and app.config['SQLITE_JOURNAL_MODE']:
+        dbapi_connection.execute(f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}")
+
+
 #==================== Database Models ====================
 
 class User(db.Model):
@@ -42,6 +150,9 @@ class User(db.Model):
         """Check if provided password matches the hash"""
         return check_password_hash(self.password_hash, password)
 
+    def __str__(self):
+        return self.full_name
+
     def __repr__(self):
         return f'<User {self.username} ({self.role})>'
 
@@ -49,16 +160,22 @@ class User(db.Model):
 class Course(db.Model):
     """Course model representing a course offering"""
     __tablename__ = 'courses'
+    __table_args__ = (
+        db.Index('ix_courses_term_name', 'term', 'course_name'),  #term rollover skips courses already cloned
+        {'sqlite_autoincrement': True}  #ids are never reused, so archived ids stay unique
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     course_name = db.Column(db.String(100), nullable=False)
-    teacher_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     time = db.Column(db.String(50), nullable=False)
     capacity = db.Column(db.Integer, nullable=False)
+    term = db.Column(db.String(20), nullable=False, index=True, default=lambda: app.config['CURRENT_TERM'])
 
     #relationships
     instructor = db.relationship('User', foreign_keys=[teacher_id], backref='courses_taught')
     enrollments = db.relationship('Enrollment', backref='course', lazy=True, cascade='all, delete-orphan')
+    meetings = db.relationship('CourseMeeting', lazy=True, cascade='all, delete-orphan')
 
     def get_enrolled_count(self):
         """Get number of students enrolled in this course"""
@@ -68,6 +185,9 @@ class Course(db.Model):
         """Check if course has reached capacity"""
         return self.get_enrolled_count() >= self.capacity
 
+    def __str__(self):
+        return self.course_name
+
     def __repr__(self):
         return f'<Course {self.course_name}>'
 
@@ -75,27 +195,816 @@ class Course(db.Model):
 class Enrollment(db.Model):
     """Enrollment model representing a student enrolled in a course"""
     __tablename__ = 'enrollments'
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = db.Column(db.Integer, primary_key=True)
-    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False, index=True)
     grade = db.Column(db.Float, default=0.0)
 
     def __repr__(self):
         return f'<Enrollment Student:{self.student_id} Course:{self.course_id}>'
 
 
+class CourseMeeting(db.Model):
+    """
+    One weekly meeting of a course, normalized from Course.time so schedule
+    conflicts can be checked in SQL (kept in sync on every Course flush)
+    """
+    __tablename__ = 'course_meetings'
+    __table_args__ = (db.Index('ix_course_meetings_window', 'start_minute', 'end_minute'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False, index=True)
+    day_mask = db.Column(db.Integer, nullable=False)  #bit per weekday, see DAY_BITS
+    start_minute = db.Column(db.Integer, nullable=False)  #minutes since midnight
+    end_minute = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<CourseMeeting Course:{self.course_id} {self.day_mask}:{self.start_minute}-{self.end_minute}>'
+
+
+class Job(db.Model):
+    """
+    Background job, inserted in the same transaction as the write that needs it
+    and run after that commit by the job worker (see Background Jobs)
+    """
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_queue', 'status', 'priority', 'run_after'),
+        #at most one pending job per key, so repeated triggers collapse into a single run
+        db.Index('ux_jobs_pending_key', 'key', unique=True, sqlite_where=db.text("status = 'pending'")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  #name registered with @job_handler
+    key = db.Column(db.String(200))  #idempotency key, optional
+    payload = db.Column(db.Text, nullable=False, default='{}')  #JSON keyword arguments for the handler
+    priority = db.Column(db.Integer, nullable=False, default=0)  #higher runs first
+    status = db.Column(db.String(10), nullable=False, default='pending')  #'pending', 'running', 'done' or 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_after = db.Column(db.Float, nullable=False)  #unix time
+    created_at = db.Column(db.Float, nullable=False)
+    started_at = db.Column(db.Float)
+    finished_at = db.Column(db.Float)
+    last_error = db.Column(db.Text)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+
+class IdempotencyKey(db.Model):
+    """Stored outcome of a write request sent with an Idempotency-Key header (see Idempotency Keys)"""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (db.UniqueConstraint('user_id', 'key', name='ux_idempotency_keys_user_key'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    key = db.Column(db.String(200), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  #sha256 of method, path and body
+    status_code = db.Column(db.Integer)  #None while the first request is still running
+    headers = db.Column(db.Text)  #JSON of the response headers worth replaying
+    body = db.Column(db.LargeBinary)
+    created_at = db.Column(db.Float, nullable=False, index=True)  #unix time
+
+    def __repr__(self):
+        return f'<IdempotencyKey User:{self.user_id} {self.key} {self.status_code}>'
+
+
+class UserSession(db.Model):
+    """Server-side session, found by the opaque id in the session cookie (see Sessions)"""
+    __tablename__ = 'sessions'
+
+    id = db.Column(db.String(64), primary_key=True)  #random token sent as the cookie value
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)  #None before login
+    data = db.Column(db.Text, nullable=False, default='{}')  #other session keys (flashes, ...), tagged JSON
+    created_at = db.Column(db.Float, nullable=False)  #unix time
+    expires_at = db.Column(db.Float, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<UserSession User:{self.user_id} expires {self.expires_at}>'
+
+
+class EventOutbox(db.Model):
+    """Event written in its mutation's transaction (strict event log mode), waiting to be relayed to the log"""
+    __tablename__ = 'event_outbox'
+    __table_args__ = {'sqlite_autoincrement': True}  #relayed ids are never reused, so "id <= last relayed" stays exact
+
+    id = db.Column(db.Integer, primary_key=True)
+    event = db.Column(db.Text, nullable=False)  #JSON, without its sequence number
+
+    def __repr__(self):
+        return f'<EventOutbox {self.id}>'
+
+
+class ArchivedCourse(db.Model):
+    """A course from a closed term, moved out of courses by `flask archive-term` (see Term Archive)"""
+    __tablename__ = 'archived_courses'
+
+    id = db.Column(db.Integer, primary_key=True)  #the course's original id
+    course_name = db.Column(db.String(100), nullable=False)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    time = db.Column(db.String(50), nullable=False)
+    capacity = db.Column(db.Integer, nullable=False)
+    term = db.Column(db.String(20), nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<ArchivedCourse {self.course_name} {self.term}>'
+
+
+class ArchivedEnrollment(db.Model):
+    """An enrollment in an archived course, keeping its original id and grade"""
+    __tablename__ = 'archived_enrollments'
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('archived_courses.id'), nullable=False, index=True)
+    grade = db.Column(db.Float, default=0.0)
+
+    def __repr__(self):
+        return f'<ArchivedEnrollment Student:{self.student_id} Course:{self.course_id}>'
+
+
+#set up backref attributes (Enrollment.student, Enrollment.course) now so views can reference them
+configure_mappers()
+
+
+#==================== Read Models ====================
+#read-only pages select just the columns they show and wrap each row in a frozen,
+#slotted dataclass, so no ORM instances are built, tracked or kept in the identity map
+
+@dataclass(frozen=True, slots=True)
+class CourseSummary:
+    """One course as listed in the catalog and on the teacher dashboard"""
+    id: int
+    course_name: str
+    teacher: str
+    time: str
+    capacity: int
+    enrolled: int
+
+    @property
+    def is_full(self):
+        return self.enrolled >= self.capacity
+
+
+@dataclass(frozen=True, slots=True)
+class RosterEntry:
+    """One student's enrollment as shown on a teacher's course page"""
+    enrollment_id: int
+    student_name: str
+    grade: float
+
+
+def load_roster(course_id):
+    """A course's students and grades, in enrollment order"""
+    if shard_router is not None:
+        return shard_router.roster(course_id)
+    return [RosterEntry(*row) for row in db.session.execute(
+        db.select(Enrollment.id, User.full_name, Enrollment.grade)
+        .join(User, Enrollment.student_id == User.id)
+        .where(Enrollment.course_id == course_id)
+        .order_by(Enrollment.id)
+    )]
+
+
+@dataclass(frozen=True, slots=True)
+class TranscriptEntry:
+    """One course on a student's transcript, from the active or the archive tables"""
+    term: str
+    course_name: str
+    teacher: str
+    grade: float
+    archived: bool
+
+
+def load_transcript(student_id):
+    """Every course a student has taken, across active and archived terms, oldest term first"""
+    active = (db.select(Course.term, Course.course_name, User.full_name, Enrollment.grade, db.false())
+              .join(Enrollment, Enrollment.course_id == Course.id)
+              .join(User, Course.teacher_id == User.id)
+              .where(Enrollment.student_id == student_id))
+    archived = (db.select(ArchivedCourse.term, ArchivedCourse.course_name, User.full_name,
+                          ArchivedEnrollment.grade, db.true())
+                .join(ArchivedEnrollment, ArchivedEnrollment.course_id == ArchivedCourse.id)
+                .join(User, ArchivedCourse.teacher_id == User.id)
+                .where(ArchivedEnrollment.student_id == student_id))
+    if shard_router is not None:
+        #active terms live in the shards; archives stay in the main database
+        rows = shard_router.student_grades(student_id) + db.session.execute(archived).all()
+    else:
+        rows = db.session.execute(db.union_all(active, archived))
+    entries = [TranscriptEntry(term, name, teacher, grade, bool(is_archived))
+               for term, name, teacher, grade, is_archived in rows]
+    return sorted(entries, key=lambda e: (term_sort_key(e.term), e.course_name))
+
+
+#==================== Caching ====================
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with a per-entry TTL and hit/miss/eviction counters"""
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  #key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Return the cached value, or default if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store a value, evicting the least recently used entry when full"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Remove one key if present"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_namespace(self, namespace):
+        """Remove every key whose first element is namespace"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == namespace]:
+                del self._entries[key]
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the counters and current size"""
+        with self._lock:
+            return {
+                'backend': 'lru',
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+
+class NullCache(LRUCache):
+    """Cache backend that never stores anything (useful for debugging and benchmarks)"""
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def stats(self):
+        stats = super().stats()
+        stats['backend'] = 'null'
+        return stats
+
+
+CACHE_BACKENDS = {'lru': LRUCache, 'null': NullCache}
+
+
+def create_cache(config):
+    """Build the cache backend named by CACHE_BACKEND"""
+    backend = CACHE_BACKENDS[config['CACHE_BACKEND']]
+    return backend(max_entries=config['CACHE_MAX_ENTRIES'], ttl=config['CACHE_TTL'])
+
+
+cache = create_cache(app.config)
+fragment_cache = CACHE_BACKENDS[app.config['CACHE_BACKEND']](
+    max_entries=app.config['FRAGMENT_CACHE_MAX_ENTRIES'], ttl=app.config['CACHE_TTL'])
+ownership_cache = CACHE_BACKENDS[app.config['CACHE_BACKEND']](
+    max_entries=app.config['OWNERSHIP_CACHE_MAX_ENTRIES'], ttl=app.config['OWNERSHIP_CACHE_TTL'])
+
+
+def cached(key, loader):
+    """Return cache[key], calling loader() to fill it on a miss"""
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = loader()
+        cache.set(key, value)
+    return value
+
+
+def invalidate_course(course_id):
+    """Drop everything derived from a course's enrollments or grades"""
+    cache.delete(('catalog',))
+    cache.delete(('course_stats', course_id))
+    cache.delete_namespace('teacher_courses')
+
+
+def load_course_catalog(teacher_id=None, fits_student_id=None):
+    """
+    Current-term courses with instructor name and enrollment count in one grouped query
+    Optionally only one teacher's courses, or only courses that fit a student's schedule
+    """
+    if shard_router is not None:
+        catalog = shard_router.load_catalog(teacher_id)
+        if fits_student_id is not None:
+            #the schedule spans shards, so the clash filter runs here instead of in SQL
+            taken = [course_time for _, _, _, course_time
+                     in shard_router.student_schedule(fits_student_id, app.config['CURRENT_TERM'])]
+            catalog = [c for c in catalog if not any(has_time_conflict(c.time, t) for t in taken)]
+        return catalog
+
+    stmt = (db.select(Course.id, Course.course_name, User.full_name, Course.time, Course.capacity,
+                      db.func.count(Enrollment.id))
+            .join(User, Course.teacher_id == User.id)
+            .outerjoin(Enrollment, Enrollment.course_id == Course.id)
+            .where(Course.term == app.config['CURRENT_TERM'])
+            .group_by(Course.id)
+            .order_by(Course.id))
+    if teacher_id is not None:
+        stmt = stmt.where(Course.teacher_id == teacher_id)
+    if fits_student_id is not None:
+        stmt = stmt.where(Course.id.not_in(conflicting_course_ids(fits_student_id)))
+
+    return [CourseSummary(*row) for row in db.session.execute(stmt)]
+
+
+def load_course_summary(course_id):
+    """One course of any term as a CourseSummary, or None if it does not exist"""
+    stmt = (db.select(Course.id, Course.course_name, Course.teacher_id, Course.time, Course.capacity,
+                      db.func.count(Enrollment.id))
+            .outerjoin(Enrollment, Enrollment.course_id == Course.id)
+            .where(Course.id == course_id)
+            .group_by(Course.id))
+    if shard_router is not None:
+        with shard_router.engine_for(course_id).connect() as conn:
+            row = conn.execute(stmt).first()
+    else:
+        row = db.session.execute(stmt).first()
+    if row is None:
+        return None
+    course_id, course_name, teacher_id, course_time, capacity, enrolled = row
+    return CourseSummary(course_id, course_name, teacher_names({teacher_id}).get(teacher_id, ''),
+                         course_time, capacity, enrolled)
+
+
+def get_course_catalog():
+    """Cached course catalog (shared by every student), with live seat counts"""
+    return with_live_seats(cached(('catalog',), load_course_catalog))
+
+
+def get_teacher_courses(teacher_id):
+    """Cached list of one teacher's courses with live enrollment counts"""
+    return with_live_seats(cached(('teacher_courses', teacher_id), lambda: load_course_catalog(teacher_id)))
+
+
+def get_course_stats(course_id):
+    """Cached per-course aggregates: enrollment count and average grade"""
+    def load():
+        if shard_router is not None:
+            enrolled, average = shard_router.course_stats(course_id)
+            return {'enrolled': enrolled, 'average_grade': average}
+        enrolled, average = db.session.execute(
+            db.select(db.func.count(Enrollment.id), db.func.avg(Enrollment.grade))
+            .where(Enrollment.course_id == course_id)
+        ).one()
+        return {'enrolled': enrolled, 'average_grade': average}
+    return cached(('course_stats', course_id), load)
+
+
+@app.template_global()
+def course_row(course, is_enrolled):
+    """
+    Render one catalog row from the fragment cache
+    The key is the CourseSummary itself (every displayed field), so any change to the course produces a new version
+    """
+    key = ('course_row', course, is_enrolled)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = Markup(app.jinja_env.get_template('_course_row.html').render(c=course, is_enrolled=is_enrolled))
+        fragment_cache.set(key, html)
+    return html
+
+
+def render_page(template_name, **context):
+    """
+    Render a template, streaming it in STREAM_CHUNK_SIZE pieces when STREAM_TEMPLATES is on
+    so the first bytes leave before large tables are finished
+    """
+    if not app.config['STREAM_TEMPLATES']:
+        return render_template(template_name, **context)
+
+    def chunked(parts, size=app.config['STREAM_CHUNK_SIZE']):
+        buffer, buffered = [], 0
+        for part in parts:
+            buffer.append(part)
+            buffered += len(part)
+            if buffered >= size:
+                yield ''.join(buffer)
+                buffer, buffered = [], 0
+        if buffer:
+            yield ''.join(buffer)
+
+    return Response(chunked(stream_template(template_name, **context)), mimetype='text/html')
+
+
+#==================== Seat Map ====================
+#capacity and enrolled count per course id in a memory-mapped file, so every worker
+#process on the machine reads seat availability without a query. Slot i holds
+#(present, capacity, enrolled) for course i. Readers take no lock; writers take a
+#thread lock plus flock on the file. The first process to touch an unloaded map fills
+#it from the database; the enroll/unenroll routes and admin edits keep it current, and
+#the database still confirms every reservation.
+
+SEAT_MAP_MAGIC = b'SEAT'
+SEAT_MAP_HEADER = struct.Struct('<4sii')  #magic, loaded flag, slot count
+SEAT_SLOT_INTS = 3
+
+
+class SeatMap:
+    """Shared-memory table of (capacity, enrolled) indexed by course id"""
+
+    def __init__(self):
+        self._mm = None
+        self._fd = None
+        self._slots = None
+        self._lock = threading.RLock()
+
+    #---------- mapping ----------
+
+    def _open(self):
+        with self._lock:
+            if self._slots is not None:
+                return
+            slots = app.config['SEAT_MAP_SLOTS']
+            size = SEAT_MAP_HEADER.size + slots * SEAT_SLOT_INTS * 4
+            path = app.config['SEAT_MAP_PATH']
+            if path is None:
+                try:
+                    path = database_path() + '-seats'
+                except ValueError:
+                    path = None  #in-memory database: a private map for this process
+            if path is None:
+                self._mm = mmap.mmap(-1, size)
+            else:
+                self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+                if os.fstat(self._fd).st_size < size:
+                    os.ftruncate(self._fd, size)
+                self._mm = mmap.mmap(self._fd, size)
+            with self._file_lock():
+                magic, _, stored_slots = SEAT_MAP_HEADER.unpack_from(self._mm)
+                if magic != SEAT_MAP_MAGIC or stored_slots != slots:
+                    self._mm[:size] = bytes(size)
+                    SEAT_MAP_HEADER.pack_into(self._mm, 0, SEAT_MAP_MAGIC, 0, slots)
+            self._slots = memoryview(self._mm)[SEAT_MAP_HEADER.size:].cast('i')
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared by every process mapping the file (a no-op for a private map)"""
+        if self._fd is None:
+            yield
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @property
+    def loaded(self):
+        return self._slots is not None and SEAT_MAP_HEADER.unpack_from(self._mm)[1] == 1
+
+    def _set_loaded(self, loaded):
+        SEAT_MAP_HEADER.pack_into(self._mm, 0, SEAT_MAP_MAGIC, int(loaded), len(self._slots) // SEAT_SLOT_INTS)
+
+    def _tracked(self, course_id):
+        return isinstance(course_id, int) and 0 < course_id < len(self._slots) // SEAT_SLOT_INTS
+
+    def _write(self, course_id, seats):
+        i = course_id * SEAT_SLOT_INTS
+        if seats is None:
+            self._slots[i] = 0
+        else:
+            self._slots[i + 1], self._slots[i + 2] = seats
+            self._slots[i] = 1
+
+    #---------- reads ----------
+
+    def get(self, course_id, load=True):
+        """(capacity, enrolled) for a course, or None if the map does not track it (or is unloaded and load is False)"""
+        if not self.loaded:
+            if not load:
+                return None
+            self.load()
+        if not self._tracked(course_id):
+            return None
+        i = course_id * SEAT_SLOT_INTS
+        if not self._slots[i]:
+            return None
+        return self._slots[i + 1], self._slots[i + 2]
+
+    def is_full(self, course_id, load=True):
+        """True or False from the map, or None when the course is not tracked"""
+        seats = self.get(course_id, load)
+        return None if seats is None else seats[1] >= seats[0]
+
+    def course_ids(self):
+        if not self.loaded:
+            self.load()
+        present = self._slots[::SEAT_SLOT_INTS].tolist()
+        return [course_id for course_id, flag in enumerate(present) if flag]
+
+    #---------- writes ----------
+
+    def load(self):
+        """Fill the map from the database (one grouped query); once per machine, not per process"""
+        self._open()
+        with self._lock, self._file_lock():
+            if SEAT_MAP_HEADER.unpack_from(self._mm)[1] == 1:
+                return
+            self._mm[SEAT_MAP_HEADER.size:] = bytes(len(self._mm) - SEAT_MAP_HEADER.size)
+            for course_id, seats in load_seat_counts().items():
+                if self._tracked(course_id):
+                    self._write(course_id, seats)
+            self._set_loaded(True)
+
+    def clear(self):
+        """Forget everything; the next read in any process reloads from the database"""
+        self._open()
+        with self._lock, self._file_lock():
+            self._set_loaded(False)
+
+    def adjust(self, course_id, delta):
+        """Add delta to a course's enrolled count after a committed enroll or unenroll"""
+        if not self.loaded or not self._tracked(course_id):
+            return
+        with self._lock, self._file_lock():
+            i = course_id * SEAT_SLOT_INTS
+            if self._slots[i]:
+                self._slots[i + 2] = max(0, self._slots[i + 2] + delta)
+
+    def set(self, course_id, seats):
+        """Overwrite a course's (capacity, enrolled), or drop it with None"""
+        if not self.loaded or not self._tracked(course_id):
+            return
+        with self._lock, self._file_lock():
+            self._write(course_id, seats)
+
+    def refresh(self, course_ids):
+        """Re-read the given courses from the database (after admin edits)"""
+        if not self.loaded:
+            return
+        for course_id, seats in load_seat_counts(course_ids).items():
+            self.set(course_id, seats)
+
+
+def load_seat_counts(course_ids=None):
+    """{course id: (capacity, enrolled) or None if the course is gone}, from the database"""
+    stmt = (db.select(Course.id, Course.capacity, db.func.count(Enrollment.id))
+            .outerjoin(Enrollment, Enrollment.course_id == Course.id)
+            .group_by(Course.id))
+    if course_ids is not None:
+        stmt = stmt.where(Course.id.in_(course_ids))
+    #every term, not just the catalog's: rolled-over courses take enrollments before their term starts
+    rows = shard_router.gather(stmt) if shard_router is not None else db.session.execute(stmt)
+    counts = {course_id: (capacity, enrolled) for course_id, capacity, enrolled in rows}
+    if course_ids is None:
+        return counts
+    return {course_id: counts.get(course_id) for course_id in course_ids}
+
+
+def with_live_seats(courses):
+    """The given CourseSummary list with capacity and enrolled taken from the seat map"""
+    live = []
+    for course in courses:
+        seats = seat_map.get(course.id)
+        if seats is not None and seats != (course.capacity, course.enrolled):
+            course = replace(course, capacity=seats[0], enrolled=seats[1])
+        live.append(course)
+    return live
+
+
+def check_seat_map(repair=False):
+    """Compare the seat map with the database; optionally overwrite the slots that disagree"""
+    expected = load_seat_counts()
+    tracked = set(seat_map.course_ids())
+    mismatches = []
+    for course_id in sorted(tracked | {course_id for course_id in expected if seat_map._tracked(course_id)}):
+        actual = seat_map.get(course_id)
+        wanted = expected.get(course_id)
+        if actual != wanted:
+            mismatches.append({'course_id': course_id,
+                               'seat_map': list(actual) if actual else None,
+                               'database': list(wanted) if wanted else None})
+            if repair:
+                seat_map.set(course_id, wanted)
+    untracked = sum(1 for course_id in expected if not seat_map._tracked(course_id))
+    return {'courses': len(expected), 'untracked': untracked, 'mismatches': mismatches, 'repaired': repair}
+
+
+seat_map = SeatMap()
+
+
+@app.cli.command('check-seats')
+@click.option('--repair', is_flag=True, help='Overwrite slots that disagree with the database')
+def check_seats_command(repair):
+    """Compare the shared seat map with the enrollments table"""
+    report = check_seat_map(repair)
+    for problem in report['mismatches']:
+        print(f"course {problem['course_id']}: seat map {problem['seat_map']}, database {problem['database']}")
+    print(f"{report['courses']} courses, {len(report['mismatches'])} mismatches"
+          + (' (repaired)' if repair and report['mismatches'] else ''))
+
+
+#==================== Response Compression ====================
+
+def choose_encoding(accept_encodings):
+    """Pick 'br' (when brotli is installed) or 'gzip' from the client's Accept-Encoding"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def make_compressor(encoding, level):
+    """Return (compress, flush, finish) callables for an incremental compressor; flush emits all input so far"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=min(level, 11))
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  #wbits=31 writes a gzip container
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def compress_stream(chunks, encoding, level):
+    """
+    Compress a streamed body chunk by chunk, keeping it streamed; each chunk is flushed
+    so the client can decode it on arrival instead of waiting for the compressor's window to fill
+    """
+    compress, flush, finish = make_compressor(encoding, level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+@app.after_request
+def compress_response(response):
+    """gzip/brotli-compress HTML, JSON and CSV responses larger than COMPRESS_MIN_SIZE"""
+    if (not app.config['COMPRESS_RESPONSES']
+            or response.direct_passthrough
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in app.config['COMPRESS_MIMETYPES']):
+        return response
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    level = app.config['COMPRESS_LEVEL']
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        compress, _, finish = make_compressor(encoding, level)
+        response.set_data(compress(data) + finish())
+
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
 #==================== Flask-Admin Setup ====================
 
 #custom ModelView for admin panel
 class SecureModelView(ModelView):
     """Secure model view that requires admin login"""
+    #views over sharded tables; with ENROLLMENT_SHARDS set they would show and edit the main database's stale copy
+    sharded_model = False
+
     def is_accessible(self):
         return session.get('role') == 'admin'
 
     def inaccessible_callback(self, name, **kwargs):
         return redirect(url_for('login'))
 
+    def is_visible(self):
+        return not (self.sharded_model and shard_router is not None)
+
+    def _handle_view(self, name, **kwargs):
+        if self.sharded_model and shard_router is not None:
+            abort(409, description=f'{self.name} cannot be edited here in sharded mode')
+        return super()._handle_view(name, **kwargs)
+
+    def on_model_change(self, form, model, is_created):
+        before = {} if is_created else column_values(model, committed=True)
+        self.queue_follow_up_jobs(model)
+        #values are read after the flush, so foreign keys set through relationships are included
+        after = column_values(model)
+        table = self.model.__tablename__
+        if is_created:
+            record_event('admin_created', table=table, id=model.id, values=after)
+        else:
+            changes = {key: [before[key], value] for key, value in after.items() if before[key] != value}
+            if changes:
+                record_event('admin_updated', table=table, id=model.id, changes=changes)
+
+    def on_model_delete(self, model):
+        record_event('admin_deleted', table=self.model.__tablename__, id=model.id, values=column_values(model))
+        self.queue_follow_up_jobs(model)
+
+    def queue_follow_up_jobs(self, model):
+        """Queue post-commit jobs for the courses an edit touches, in the edit's own transaction"""
+        self.session.flush()  #assign ids and foreign keys set through relationships
+        g.admin_course_ids = affected_course_ids(model)
+        for course_id in g.admin_course_ids:
+            enqueue_job(*refresh_course_job(course_id))
+
+    def after_model_change(self, form, model, is_created):
+        """Admin edits can touch names, times, capacities, rosters or instructors, so drop all cached reads"""
+        cache.clear()
+        ownership_cache.clear()
+        seat_map.refresh(g.pop('admin_course_ids', ()))
+
+    def after_model_delete(self, model):
+        cache.clear()
+        ownership_cache.clear()
+        seat_map.refresh(g.pop('admin_course_ids', ()))
+
+    #---------- list view scaling ----------
+    #with no search, filter or explicit sort, list pages are read by primary key
+    #(keyset pagination) and the row count comes from a short-lived cache, so
+    #page N costs the same as page 1 and no page runs COUNT(*) over the table
+
+    def get_cached_count(self):
+        """Row count for the unfiltered list, recomputed at most every ADMIN_COUNT_CACHE_TTL seconds"""
+        key = ('admin_count', self.model.__tablename__)
+        count = cache.get(key)
+        if count is None:
+            count = self.get_count_query().scalar()
+            cache.set(key, count, ttl=app.config['ADMIN_COUNT_CACHE_TTL'])
+        return count
+
+    def page_start_key(self, page, page_size):
+        """
+        Return ('after', last_pk_of_previous_page) when the previous page was seen recently,
+        otherwise ('from', first_pk_of_page) found by an index-only OFFSET over the primary key
+        """
+        after = cache.get(('admin_page_end', self.model.__tablename__, page_size, page - 1))
+        if after is not None:
+            return 'after', after
+        pk = getattr(self.model, self._primary_key)
+        first = self.session.scalar(db.select(pk).order_by(pk).offset(page * page_size).limit(1))
+        return 'from', first
+
+    def get_list(self, page, sort_column, sort_desc, search, filters,
+                 execute=True, page_size=None):
+        if search or filters or sort_column is not None or not execute:
+            return super().get_list(page, sort_column, sort_desc, search, filters,
+                                    execute=execute, page_size=page_size)
+
+        page_size = self.page_size if page_size is None else page_size
+        pk = getattr(self.model, self._primary_key)
+        query = self.get_query()
+        for relation in self._auto_joins:
+            query = query.options(joinedload(relation))
+
+        if page and page_size:
+            mode, key = self.page_start_key(page, page_size)
+            if key is None:
+                return self.get_cached_count(), []
+            query = query.filter(pk > key if mode == 'after' else pk >= key)
+
+        query = query.order_by(pk)
+        if page_size:
+            query = query.limit(page_size)
+        rows = query.all()
+
+        if rows and page_size:
+            cache.set(('admin_page_end', self.model.__tablename__, page_size, page or 0),
+                      getattr(rows[-1], self._primary_key), ttl=app.config['ADMIN_COUNT_CACHE_TTL'])
+        return self.get_cached_count(), rows
+
 
 class UserAdmin(SecureModelView):
     """Admin view for User - only shows basic fields"""
@@ -105,14 +1014,35 @@ class UserAdmin(SecureModelView):
     column_exclude_list = ('password_hash',)
 
     def on_model_change(self, form, model, is_created):
-        """Set default password for new users"""
+        """Set default password for new users; a role change signs the user out everywhere"""
         if is_created:
             model.set_password('password123')
+        elif inspect(model).attrs.role.history.has_changes():
+            g.admin_session_ids = revoke_user_sessions(model.id)
+        else:
+            g.admin_session_ids = user_session_ids(model.id)  #reloaded with the new name
+        super().on_model_change(form, model, is_created)
+
+    def on_model_delete(self, model):
+        g.admin_session_ids = revoke_user_sessions(model.id)
+        super().on_model_delete(model)
+
+    def after_model_change(self, form, model, is_created):
+        super().after_model_change(form, model, is_created)
+        evict_sessions(g.pop('admin_session_ids', ()))
+
+    def after_model_delete(self, model):
+        super().after_model_delete(model)
+        evict_sessions(g.pop('admin_session_ids', ()))
 
 
 class CourseAdmin(SecureModelView):
     """Admin view for Course with instructor selection"""
-    column_list = ('course_name', 'instructor', 'time', 'capacity')
+    sharded_model = True
+    column_list = ('course_name', 'instructor', 'time', 'capacity', 'term')
+
+    # Load instructors in the same query as the page instead of one query per row
+    column_select_related_list = (Course.instructor,)
 
     # Display instructor's full name in the list view
     column_formatters = {
@@ -120,27 +1050,165 @@ class CourseAdmin(SecureModelView):
     }
 
     # Exclude teacher_id from column display but include in form
-    form_columns = ('course_name', 'instructor', 'time', 'capacity')
+    form_columns = ('course_name', 'instructor', 'time', 'capacity', 'term')
 
-    # Customize form args to filter teachers only
     form_args = {
-        'instructor': {
-            'label': 'Instructor',
-            'query_factory': lambda: User.query.filter_by(role='teacher').all(),
-            'get_label': 'full_name'
-        }
+        'instructor': {'label': 'Instructor'},
+        'term': {'default': lambda: app.config['CURRENT_TERM']}
     }
 
+    # Search teachers as the admin types instead of loading every teacher into a dropdown
+    form_ajax_refs = {
+        'instructor': QueryAjaxModelLoader('instructor', db.session, User,
+                                           fields=['full_name', 'username'],
+                                           filters=["role = 'teacher'"],
+                                           order_by=User.full_name,
+                                           page_size=20)
+    }
+
+    def on_model_change(self, form, model, is_created):
+        """Reject unparseable times, instructor double-booking and capacity below enrollment"""
+        problems = validate_course(model)
+        if problems:
+            raise ValidationError(' '.join(problems))
+        super().on_model_change(form, model, is_created)
+
+    @action('rollover', 'Roll over to a new term')
+    def action_rollover(self, ids):
+        """Open the term rollover page with the checked courses preselected"""
+        return redirect(url_for('rollover.index', course_id=ids))
+
+
+class EnrollmentAdmin(SecureModelView):
+    """Admin view for Enrollment with student and course lookups"""
+    sharded_model = True
+    column_list = ('student', 'course', 'grade')
+    column_select_related_list = (Enrollment.student, Enrollment.course)
+
+    form_columns = ('student', 'course', 'grade')
+    form_ajax_refs = {
+        'student': QueryAjaxModelLoader('student', db.session, User,
+                                        fields=['full_name', 'username'],
+                                        filters=["role = 'student'"],
+                                        order_by=User.full_name,
+                                        page_size=20),
+        'course': QueryAjaxModelLoader('course', db.session, Course,
+                                       fields=['course_name'],
+                                       order_by=Course.course_name,
+                                       page_size=20)
+    }
+
+
+class SecureAdminIndexView(AdminIndexView):
+    """Admin landing page; like the model views, admins only"""
+    def is_accessible(self):
+        return session.get('role') == 'admin'
+
+    def inaccessible_callback(self, name, **kwargs):
+        return redirect(url_for('login'))
+
 
 #initialize Flask-Admin
-admin = Admin(app, name='ACME University Admin', template_mode='bootstrap3')
+admin = Admin(app, name='ACME University Admin', template_mode='bootstrap3', index_view=SecureAdminIndexView())
 admin.add_view(UserAdmin(User, db.session))
 admin.add_view(CourseAdmin(Course, db.session))
-admin.add_view(SecureModelView(Enrollment, db.session))
+admin.add_view(EnrollmentAdmin(Enrollment, db.session))
+admin.add_link(MenuLink(name='Export Gradebook (CSV)', url='/admin/export/gradebook.csv'))
+admin.add_link(MenuLink(name='Export Gradebook (XLSX)', url='/admin/export/gradebook.xlsx'))
+admin.add_link(MenuLink(name='Cache Stats', url='/admin/cache/stats'))
+admin.add_link(MenuLink(name='Catalog Audit', url='/admin/audit'))
+admin.add_link(MenuLink(name='Job Queue', url='/admin/jobs/stats'))
+admin.add_link(MenuLink(name='Terms', url='/admin/terms'))
+admin.add_link(MenuLink(name='Backups', url='/admin/backup'))
+admin.add_link(MenuLink(name='Seat Map Check', url='/admin/seats/check'))
 # Add a logout link to the admin interface so admins can sign out easily
 admin.add_link(MenuLink(name='Logout', url='/logout'))
 
 
+#==================== Authorization ====================
+
+def role_required(role):
+    """
+    Page decorator: send signed-out users to the login page and users
+    with a different role back through the index redirect
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if 'user_id' not in session:
+                return redirect(url_for('login'))
+            if session.get('role') != role:
+                return redirect(url_for('index'))
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def api_role_required(role):
+    """API decorator: answer 401 JSON unless the session belongs to a user with this role"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if 'user_id' not in session or session.get('role') != role:
+                return jsonify({'error': 'Unauthorized'}), 401
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def course_owner(course_id):
+    """
+    Return the teacher id that owns a course, or None if the course does not exist
+    One indexed scalar query, then served from the ownership cache
+    """
+    key = ('course', course_id)
+    owner = ownership_cache.get(key, _MISSING)
+    if owner is _MISSING:
+        if shard_router is not None:
+            owner = shard_router.course_owner(course_id)
+        else:
+            owner = db.session.scalar(db.select(Course.teacher_id).where(Course.id == course_id))
+        ownership_cache.set(key, owner)
+    return owner
+
+
+def enrollment_owner(enrollment_id):
+    """
+    Return (course_id, teacher_id) for an enrollment, or None if it does not exist
+    One primary-key join, then served from the ownership cache
+    """
+    key = ('enrollment', enrollment_id)
+    owner = ownership_cache.get(key, _MISSING)
+    if owner is _MISSING and shard_router is not None:
+        owner = shard_router.enrollment_owner(enrollment_id)
+        ownership_cache.set(key, owner)
+    elif owner is _MISSING:
+        row = db.session.execute(
+            db.select(Enrollment.course_id, Course.teacher_id)
+            .join(Course, Enrollment.course_id == Course.id)
+            .where(Enrollment.id == enrollment_id)
+        ).first()
+        owner = tuple(row) if row else None
+        ownership_cache.set(key, owner)
+    return owner
+
+
+def course_owner_required(view):
+    """
+    Page decorator for teacher course routes: 404 for unknown courses,
+    back to the teacher dashboard for courses the teacher does not own
+    """
+    @wraps(view)
+    def wrapper(course_id, *args, **kwargs):
+        owner = course_owner(course_id)
+        if owner is None:
+            abort(404)
+        if owner != session['user_id']:
+            return redirect(url_for('teacher_dashboard'))
+        return view(course_id, *args, **kwargs)
+    return wrapper
+
+
 #==================== Routes ====================
 
 @app.route('/')
@@ -203,68 +1271,45 @@ def logout():
 
 
 @app.route('/student/dashboard')
+@role_required('student')
 def student_dashboard():
     """Student dashboard showing their courses and available courses"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    if session.get('role') != 'student':
-        return redirect(url_for('index'))
-
     user_id = session['user_id']
 
-    #get student's enrolled courses
-    enrollments = Enrollment.query.filter_by(student_id=user_id).all()
-    my_courses = [{
-        'id': e.course.id,
-        'course_name': e.course.course_name,
-        'teacher': e.course.instructor.full_name,
-        'time': e.course.time,
-        'enrolled': e.course.get_enrolled_count(),
-        'capacity': e.course.capacity
-    } for e in enrollments]
-
-    #get all available courses
-    all_courses = Course.query.all()
-    enrolled_course_ids = [e.course_id for e in enrollments]
-
-    available_courses = [{
-        'id': c.id,
-        'course_name': c.course_name,
-        'teacher': c.instructor.full_name,
-        'time': c.time,
-        'enrolled': c.get_enrolled_count(),
-        'capacity': c.capacity,
-        'is_full': c.is_full(),
-        'is_enrolled': c.id in enrolled_course_ids
-    } for c in all_courses]
-
-    return render_template('student_dashboard.html',
-                         my_courses=my_courses,
-                         available_courses=available_courses,
-                         full_name=session['full_name'])
+    #get student's enrolled course ids (in enrollment order); sharded mode gathers them from every shard
+    if shard_router is not None:
+        enrolled_course_ids = [course_id for _, course_id, _, _ in shard_router.student_schedule(user_id)]
+    else:
+        enrolled_course_ids = list(db.session.scalars(
+            db.select(Enrollment.course_id).where(Enrollment.student_id == user_id).order_by(Enrollment.id)
+        ))
+
+    #the catalog is shared and cached; only the enrolled flags are per student
+    catalog = get_course_catalog()
+    enrolled_order = {cid: i for i, cid in enumerate(enrolled_course_ids)}
+    my_courses = sorted((c for c in catalog if c.id in enrolled_order), key=lambda c: enrolled_order[c.id])
+
+    #?fits=1 filters out courses that clash with the student's schedule (done in SQL)
+    fits_only = request.args.get('fits') == '1'
+    if fits_only:
+        catalog = load_course_catalog(fits_student_id=user_id)
+
+    return render_page('student_dashboard.html',
+                       my_courses=my_courses,
+                       available_courses=catalog,
+                       enrolled_ids=enrolled_order,
+                       fits_only=fits_only,
+                       full_name=session['full_name'])
 
 
 @app.route('/teacher/dashboard')
+@role_required('teacher')
 def teacher_dashboard():
     """Teacher dashboard showing their courses and enrolled students"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    if session.get('role') != 'teacher':
-        return redirect(url_for('index'))
-
     user_id = session['user_id']
 
     #get teacher's courses
-    courses = Course.query.filter_by(teacher_id=user_id).all()
-
-    courses_data = [{
-        'id': c.id,
-        'course_name': c.course_name,
-        'teacher': c.instructor.full_name,
-        'time': c.time,
-        'enrolled': c.get_enrolled_count(),
-        'capacity': c.capacity
-    } for c in courses]
+    courses_data = get_teacher_courses(user_id)
 
     return render_template('teacher_dashboard.html',
                          courses=courses_data,
@@ -272,30 +1317,22 @@ def teacher_dashboard():
 
 
 @app.route('/teacher/course/<int:course_id>')
+@role_required('teacher')
+@course_owner_required
 def teacher_course_detail(course_id):
     """View students and grades for a specific course"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    if session.get('role') != 'teacher':
-        return redirect(url_for('index'))
-
-    course = Course.query.get_or_404(course_id)
-
-    #ensure teacher owns this course
-    if course.teacher_id != session['user_id']:
-        return redirect(url_for('teacher_dashboard'))
-
-    #get enrolled students
-    enrollments = Enrollment.query.filter_by(course_id=course_id).all()
-    students = [{
-        'enrollment_id': e.id,
-        'student_name': e.student.full_name,
-        'grade': e.grade
-    } for e in enrollments]
+    #ownership is already verified, so the course usually comes from the teacher's cached course list;
+    #courses of other terms are not in it, and one assigned since the list was cached is read directly
+    course = next((c for c in get_teacher_courses(session['user_id']) if c.id == course_id), None)
+    if course is None:
+        course = load_course_summary(course_id)
+    if course is None:
+        abort(404)
 
     return render_template('teacher_course_detail.html',
                          course=course,
-                         students=students,
+                         stats=get_course_stats(course_id),
+                         students=load_roster(course_id),
                          full_name=session['full_name'])
 
 
@@ -318,15 +1355,18 @@ def parse_time_slot(time_str):
         days = set()
         i = 0
         while i < len(days_str):
-            if i + 1 < len(days_str) and days_str[i:i+2] in ['TR', 'Th']:
+            if days_str[i:i+2] == 'Th':
                 days.add('R')  # Thursday
                 i += 2
-            elif days_str[i] in ['M', 'T', 'W', 'F']:
-                days.add(days_str[i])
+            elif days_str[i] in ['M', 'T', 'W', 'R', 'F']:
+                days.add(days_str[i])  # 'TR' is Tuesday + Thursday
                 i += 1
             else:
                 i += 1
 
+        if not days:
+            return None
+
         # Parse time range (e.g., "2:00-2:50 PM" or "11:00-11:50 AM")
         if '-' not in time_range:
             return None
@@ -369,36 +1409,1839 @@ def parse_time_slot(time_str):
         return None
 
 
+def parse_meetings(time_str):
+    """
+    Parse a course time that may list several meetings separated by ';'
+    e.g. 'MWF 10:00-10:50 AM; R 2:00-3:15 PM'
+    Returns: list of (days_set, start_minutes, end_minutes) or None if any part is invalid
+    """
+    if not time_str:
+        return None
+    slots = [parse_time_slot(part) for part in time_str.split(';') if part.strip()]
+    if not slots or not all(slots):
+        return None
+    return slots
+
+
 def has_time_conflict(time1, time2):
     """
     Check if two course times conflict
     Returns True if there's a conflict, False otherwise
     """
-    slot1 = parse_time_slot(time1)
-    slot2 = parse_time_slot(time2)
+    slots1 = parse_meetings(time1)
+    slots2 = parse_meetings(time2)
 
     # If either time can't be parsed, assume no conflict (fail gracefully)
-    if not slot1 or not slot2:
+    if not slots1 or not slots2:
         return False
 
-    days1, start1, end1 = slot1
-    days2, start2, end2 = slot2
+    for days1, start1, end1 in slots1:
+        for days2, start2, end2 in slots2:
+            # Conflict if they share a day and one starts before the other ends
+            if days1.intersection(days2) and not (end1 <= start2 or end2 <= start1):
+                return True
+    return False
+
+
+#==================== Meeting Times ====================
+
+WEEKDAYS = 'MTWRF'
+DAY_BITS = {day: 1 << i for i, day in enumerate(WEEKDAYS)}
+
+
+def day_mask(days):
+    """Encode a set of day letters as a bitmask (M=1, T=2, W=4, R=8, F=16)"""
+    mask = 0
+    for day in days:
+        mask |= DAY_BITS[day]
+    return mask
+
+
+def meeting_rows(time_str):
+    """Normalized (day_mask, start_minute, end_minute) rows for a course time, [] if unparseable"""
+    return [(day_mask(days), start, end) for days, start, end in parse_meetings(time_str) or []]
+
+
+@event.listens_for(db.session, 'before_flush')
+def sync_course_meetings_on_flush(session, flush_context, instances):
+    """Rebuild CourseMeeting rows for every new course and every course whose time changed"""
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Course):
+            continue
+        if obj in session.new or inspect(obj).attrs.time.history.has_changes():
+            obj.meetings = [CourseMeeting(day_mask=mask, start_minute=start, end_minute=end)
+                            for mask, start, end in meeting_rows(obj.time)]
+
+
+def backfill_course_meetings(batch_size=5000):
+    """
+    Rebuild course_meetings for every course in bulk
+    Needed for databases created before meeting times were normalized, and after bulk Core inserts
+    Returns the number of courses processed
+    """
+    db.session.execute(db.delete(CourseMeeting))
+    processed = 0
+    batch = []
+    for course_id, course_time in db.session.execute(db.select(Course.id, Course.time)):
+        processed += 1
+        batch.extend({'course_id': course_id, 'day_mask': mask, 'start_minute': start, 'end_minute': end}
+                     for mask, start, end in meeting_rows(course_time))
+        if len(batch) >= batch_size:
+            db.session.execute(db.insert(CourseMeeting), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(CourseMeeting), batch)
+    db.session.commit()
+    return processed
+
+
+def conflicting_course_ids(student_id):
+    """
+    Subquery of course ids with a meeting that overlaps any of the student's current-term meetings
+    Resolved entirely in SQL against the normalized course_meetings table
+    """
+    mine = db.aliased(CourseMeeting)
+    other = db.aliased(CourseMeeting)
+    return (db.select(other.course_id)
+            .join(mine, db.and_(other.day_mask.op('&')(mine.day_mask) != 0,
+                                other.start_minute < mine.end_minute,
+                                mine.start_minute < other.end_minute))
+            .join(Enrollment, Enrollment.course_id == mine.course_id)
+            .join(Course, Course.id == mine.course_id)
+            .where(Enrollment.student_id == student_id, Course.term == app.config['CURRENT_TERM']))
+
+
+#==================== Catalog Audit ====================
+
+def instructor_clashes(intervals):
+    """
+    Sweep-line overlap detection
+    intervals: (teacher_id, day, start, end, course_id) tuples
+    Sorted by (teacher, day, start); a heap keyed by end time holds the intervals still open at
+    each start, so every overlapping pair is reported with O(n log n + pairs) work instead of
+    comparing all pairs
+    Returns {(teacher_id, course_a, course_b): set_of_days} with course_a < course_b
+    """
+    clashes = {}
+    current = None  #(teacher_id, day) being swept
+    active = []  #heap of (end, course_id) for intervals open at the current start
+    for teacher_id, day, start, end, course_id in sorted(intervals):
+        if (teacher_id, day) != current:
+            current = (teacher_id, day)
+            active = []
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for _, other in active:
+            if other != course_id:
+                pair = (teacher_id,) + tuple(sorted((course_id, other)))
+                clashes.setdefault(pair, set()).add(day)
+        heapq.heappush(active, (end, course_id))
+    return clashes
+
+
+def audit_catalog():
+    """
+    Check every course in one pass for instructor double-booking, unparseable
+    time strings (which has_time_conflict silently treats as "no conflict")
+    and enrollment above capacity
+    """
+    stmt = (db.select(Course.id, Course.course_name, Course.teacher_id, Course.time,
+                      Course.capacity, Course.term, db.func.count(Enrollment.id))
+            .outerjoin(Enrollment, Enrollment.course_id == Course.id)
+            .group_by(Course.id))
+    rows = shard_router.gather(stmt) if shard_router is not None else db.session.execute(stmt).all()
+    teachers = teacher_names({row.teacher_id for row in rows})
+
+    names = {}
+    intervals = []
+    unparseable = []
+    over_capacity = []
+    for course_id, course_name, teacher_id, course_time, capacity, term, enrolled in rows:
+        names[course_id] = course_name
+        meetings = parse_meetings(course_time)
+        if meetings is None:
+            unparseable.append({'course_id': course_id, 'course_name': course_name, 'time': course_time})
+        else:
+            #an instructor only clashes with their own courses in the same term
+            intervals.extend(((teacher_id, term), day, start, end, course_id)
+                             for days, start, end in meetings for day in days)
+        if enrolled > capacity:
+            over_capacity.append({'course_id': course_id, 'course_name': course_name,
+                                  'enrolled': enrolled, 'capacity': capacity})
+
+    clashes = [{
+        'teacher_id': teacher_id,
+        'teacher': teachers.get(teacher_id, ''),
+        'term': term,
+        'course_ids': [course_a, course_b],
+        'course_names': [names[course_a], names[course_b]],
+        'days': ''.join(day for day in WEEKDAYS if day in days)
+    } for ((teacher_id, term), course_a, course_b), days in sorted(instructor_clashes(intervals).items())]
+
+    return {
+        'courses_checked': len(rows),
+        'instructor_clashes': clashes,
+        'unparseable_times': unparseable,
+        'over_capacity': over_capacity
+    }
+
+
+def validate_course(course):
+    """
+    Problems that should stop a course from being saved (used by CourseAdmin)
+    Returns a list of messages, empty when the course is valid
+    """
+    problems = []
+    teacher_id = course.instructor.id if course.instructor else course.teacher_id
+    term = course.term or app.config['CURRENT_TERM']
+
+    with db.session.no_autoflush:
+        if parse_meetings(course.time) is None:
+            problems.append(f"Time '{course.time}' is not recognised (expected e.g. 'MWF 10:00-10:50 AM').")
+        elif teacher_id is not None:
+            others = db.session.execute(
+                db.select(Course.course_name, Course.time)
+                .where(Course.teacher_id == teacher_id, Course.term == term, Course.id != course.id)
+            )
+            for other_name, other_time in others:
+                if has_time_conflict(course.time, other_time):
+                    problems.append(f'Instructor already teaches {other_name} at {other_time}.')
+                    break
+
+        if course.id is not None:
+            enrolled = db.session.scalar(db.select(db.func.count(Enrollment.id))
+                                         .where(Enrollment.course_id == course.id))
+            if course.capacity is not None and enrolled > course.capacity:
+                problems.append(f'Capacity {course.capacity} is below the {enrolled} students already enrolled.')
+    return problems
+
+
+@app.cli.command('audit-catalog')
+def audit_catalog_command():
+    """Report instructor clashes, unparseable times and over-capacity courses"""
+    report = audit_catalog()
+    print(f"Checked {report['courses_checked']} courses")
+    print(f"\nInstructor clashes: {len(report['instructor_clashes'])}")
+    for clash in report['instructor_clashes']:
+        print(f"  {clash['teacher']}: {' / '.join(clash['course_names'])} ({clash['days']})")
+    print(f"\nUnparseable times: {len(report['unparseable_times'])}")
+    for course in report['unparseable_times']:
+        print(f"  {course['course_name']} (id {course['course_id']}): {course['time']!r}")
+    print(f"\nOver capacity: {len(report['over_capacity'])}")
+    for course in report['over_capacity']:
+        print(f"  {course['course_name']} (id {course['course_id']}): {course['enrolled']}/{course['capacity']}")
+
+
+@app.cli.command('backfill-meetings')
+def backfill_meetings_command():
+    """Rebuild normalized meeting times for every course"""
+    db.create_all()
+    print(f'Backfilled meeting times for {backfill_course_meetings()} courses')
+
+
+#==================== Term Archive ====================
+#courses carry a term; once a term is closed its courses and enrollments are moved to
+#archived_courses / archived_enrollments, so the hot tables (and every index, catalog
+#query and admin page over them) only hold open terms
+
+TERM_SEASONS = ('Winter', 'Spring', 'Summer', 'Fall')
+
+
+def term_sort_key(term):
+    """Chronological sort key for terms named like 'Fall 2025'; other names sort first, alphabetically"""
+    season, _, year = (term or '').rpartition(' ')
+    if season in TERM_SEASONS and year.isdigit():
+        return (int(year), TERM_SEASONS.index(season), term)
+    return (0, 0, term or '')
+
+
+def archive_term(term):
+    """
+    Move every course of a closed term and its enrollments into the archive tables
+    Runs as INSERT ... SELECT / DELETE statements in one transaction, so a term is never half-moved
+    """
+    if shard_router is not None:
+        raise ValueError('Term archiving is not available in sharded mode')
+    if term == app.config['CURRENT_TERM']:
+        raise ValueError(f'{term} is the current term and cannot be archived')
+
+    term_course_ids = db.select(Course.id).where(Course.term == term)
+    courses = db.session.execute(db.insert(ArchivedCourse).from_select(
+        ['id', 'course_name', 'teacher_id', 'time', 'capacity', 'term'],
+        db.select(Course.id, Course.course_name, Course.teacher_id, Course.time, Course.capacity, Course.term)
+        .where(Course.term == term))).rowcount
+    enrollments = db.session.execute(db.insert(ArchivedEnrollment).from_select(
+        ['id', 'student_id', 'course_id', 'grade'],
+        db.select(Enrollment.id, Enrollment.student_id, Enrollment.course_id, Enrollment.grade)
+        .where(Enrollment.course_id.in_(term_course_ids)))).rowcount
+    db.session.execute(db.delete(Enrollment).where(Enrollment.course_id.in_(term_course_ids)),
+                       execution_options={'synchronize_session': False})
+    db.session.execute(db.delete(CourseMeeting).where(CourseMeeting.course_id.in_(term_course_ids)),
+                       execution_options={'synchronize_session': False})
+    db.session.execute(db.delete(Course).where(Course.term == term),
+                       execution_options={'synchronize_session': False})
+    record_event('term_archived', term=term, courses=courses, enrollments=enrollments)
+    db.session.commit()
+
+    cache.clear()
+    fragment_cache.clear()
+    ownership_cache.clear()
+    seat_map.clear()
+    return {'term': term, 'courses': courses, 'enrollments': enrollments}
+
+
+def term_summary():
+    """Courses, enrollments and average grade per term, across active and archived terms"""
+    def per_term(course, enrollment, archived):
+        return (db.select(course.term, db.func.count(db.distinct(course.id)), db.func.count(enrollment.id),
+                          db.func.avg(enrollment.grade), db.literal(archived))
+                .outerjoin(enrollment, enrollment.course_id == course.id)
+                .group_by(course.term))
+
+    if shard_router is not None:
+        rows = shard_router.term_totals() + db.session.execute(per_term(ArchivedCourse, ArchivedEnrollment, True)).all()
+    else:
+        rows = db.session.execute(db.union_all(per_term(Course, Enrollment, False),
+                                               per_term(ArchivedCourse, ArchivedEnrollment, True))).all()
+    return [{
+        'term': term,
+        'courses': courses,
+        'enrollments': enrollments,
+        'average_grade': round(average, 2) if average is not None else None,
+        'archived': bool(archived),
+        'current': term == app.config['CURRENT_TERM']
+    } for term, courses, enrollments, average, archived in sorted(rows, key=lambda r: term_sort_key(r[0]))]
+
+
+def upgrade_schema():
+    """Add columns introduced after a database was created (create_all only adds missing tables)"""
+    columns = {column['name'] for column in inspect(db.engine).get_columns('courses')}
+    if 'term' not in columns:
+        default = app.config['CURRENT_TERM'].replace("'", "''")  #DDL defaults cannot be bound parameters
+        with db.engine.begin() as conn:
+            conn.execute(db.text(f"ALTER TABLE courses ADD COLUMN term VARCHAR(20) NOT NULL DEFAULT '{default}'"))
+            conn.execute(db.text('CREATE INDEX IF NOT EXISTS ix_courses_term ON courses (term)'))
+    with db.engine.begin() as conn:
+        for model, archive in ((Course, ArchivedCourse), (Enrollment, ArchivedEnrollment)):
+            add_autoincrement(conn, model.__table__, archive.__table__)
+        conn.execute(db.text('CREATE INDEX IF NOT EXISTS ix_courses_term_name ON courses (term, course_name)'))
+
+
+def add_autoincrement(conn, table, archive):
+    """
+    Rebuild a table created before its ids used AUTOINCREMENT, which ALTER TABLE cannot add
+    Without it SQLite reuses the highest deleted id, so a new row could take the id of one
+    already moved to the archive table; the id counter starts past both tables' ids
+    """
+    ddl = conn.scalar(db.text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                      {'name': table.name})
+    if ddl is None or 'AUTOINCREMENT' in ddl.upper():
+        return
+    columns = ', '.join(column.name for column in table.columns)
+    rebuilt = f'{table.name}_rebuilt'
+    create = str(db.schema.CreateTable(table).compile(conn))
+    conn.execute(db.text(create.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {rebuilt} ', 1)))
+    conn.execute(db.text(f'INSERT INTO {rebuilt} ({columns}) SELECT {columns} FROM {table.name}'))
+    conn.execute(db.text(f'DROP TABLE {table.name}'))
+    conn.execute(db.text(f'ALTER TABLE {rebuilt} RENAME TO {table.name}'))
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+    last_id = max(conn.scalar(db.select(db.func.max(table.c.id))) or 0,
+                  conn.scalar(db.select(db.func.max(archive.c.id))) or 0)
+    conn.execute(db.text('DELETE FROM sqlite_sequence WHERE name = :name'), {'name': table.name})
+    conn.execute(db.text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+                 {'name': table.name, 'seq': last_id})
+
+
+@app.cli.command('archive-term')
+@click.argument('term')
+def archive_term_command(term):
+    """Move a closed term's courses and enrollments into the archive tables"""
+    try:
+        moved = archive_term(term)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    print(f"Archived {moved['courses']} courses and {moved['enrollments']} enrollments from {term}")
+
+
+#==================== Term Rollover ====================
+#next term's catalog starts as a copy of this one: the chosen courses are cloned into the
+#new term by one INSERT ... SELECT joined against a temporary table of capacity/time
+#changes (uploaded as CSV), and the clones' meeting rows are built in the same transaction
+
+ROLLOVER_CSV_COLUMNS = ('course_id', 'capacity', 'time')
+
+#per-connection scratch table holding the selected courses and their adjustments
+rollover_courses = db.Table(
+    'rollover_courses', db.MetaData(),
+    db.Column('course_id', db.Integer, primary_key=True),
+    db.Column('capacity', db.Integer),
+    db.Column('time', db.String(50)),
+    prefixes=['TEMPORARY']
+)
+
+
+def parse_rollover_csv(stream):
+    """
+    {source course id: (capacity or None, time or None)} from CSV with course_id, capacity and time columns
+    Blank cells keep the source course's value; raises ValueError naming the first bad line
+    """
+    reader = csv.DictReader(stream)
+    if 'course_id' not in (reader.fieldnames or ()):
+        raise ValueError(f"Adjustments CSV needs a header row with {', '.join(ROLLOVER_CSV_COLUMNS)}")
+    adjustments = {}
+    for row in reader:
+        line = reader.line_num
+        try:
+            course_id = int(row['course_id'])
+            capacity = int(row['capacity']) if (row.get('capacity') or '').strip() else None
+        except (TypeError, ValueError):
+            raise ValueError(f'Line {line}: course_id and capacity must be whole numbers')
+        course_time = (row.get('time') or '').strip() or None
+        if capacity is not None and capacity < 1:
+            raise ValueError(f'Line {line}: capacity must be at least 1')
+        if course_time is not None and parse_meetings(course_time) is None:
+            raise ValueError(f"Line {line}: time '{course_time}' is not recognised (expected e.g. 'MWF 10:00-10:50 AM')")
+        if course_id in adjustments:
+            raise ValueError(f'Line {line}: course {course_id} is listed twice')
+        adjustments[course_id] = (capacity, course_time)
+    return adjustments
+
+
+def rollover_term(source, target, course_ids=None, adjustments=None, batch_size=5000):
+    """
+    Clone the source term's courses (all, or only course_ids) into the target term, with
+    adjustments {course id: (capacity, time)} applied on the way, in one transaction
+    Courses the target term already has (same name and instructor) are skipped, so a rollover can be re-run
+    """
+    target = (target or '').strip()
+    if shard_router is not None:
+        raise ValueError('Term rollover is not available in sharded mode')
+    if not target or len(target) > Course.term.type.length:
+        raise ValueError(f'The new term needs a name of 1 to {Course.term.type.length} characters')
+    if target == source:
+        raise ValueError('The new term must differ from the source term')
+    adjustments = adjustments or {}
+    chosen = adjustments.keys() if course_ids is None else set(course_ids)
+    if not chosen >= adjustments.keys():
+        raise ValueError('Adjustments list courses that are not selected for the rollover')
+
+    conn = db.session.connection()
+    rollover_courses.drop(conn, checkfirst=True)  #left behind by a failed rollover on this connection
+    rollover_courses.create(conn)
+    try:
+        if chosen:
+            db.session.execute(db.insert(rollover_courses), [
+                {'course_id': course_id, 'capacity': adjustments.get(course_id, (None, None))[0],
+                 'time': adjustments.get(course_id, (None, None))[1]} for course_id in chosen])
+        unmatched = db.session.scalar(db.select(db.func.count()).select_from(rollover_courses).where(
+            rollover_courses.c.course_id.not_in(db.select(Course.id).where(Course.term == source))))
+        if unmatched:
+            raise ValueError(f'{unmatched} selected or adjusted courses are not in {source}')
+
+        existing = db.aliased(Course)
+        candidates = (db.select(Course.course_name, Course.teacher_id,
+                                db.func.coalesce(rollover_courses.c.time, Course.time),
+                                db.func.coalesce(rollover_courses.c.capacity, Course.capacity),
+                                db.literal(target))
+                      .join(rollover_courses, rollover_courses.c.course_id == Course.id, isouter=course_ids is None)
+                      .where(Course.term == source))
+        selected = db.session.scalar(db.select(db.func.count()).select_from(candidates.subquery()))
+        candidates = candidates.where(~db.exists().where(existing.term == target,
+                                                         existing.course_name == Course.course_name,
+                                                         existing.teacher_id == Course.teacher_id))
+        #selected rows without a capacity or time change are clones, not adjustments
+        adjusted = db.session.scalar(db.select(db.func.count()).select_from(
+            candidates.where(db.or_(rollover_courses.c.capacity.is_not(None),
+                                    rollover_courses.c.time.is_not(None))).subquery()))
+        result = db.session.execute(db.insert(Course).from_select(
+            ['course_name', 'teacher_id', 'time', 'capacity', 'term'], candidates))
+        cloned = result.rowcount
+
+        #one INSERT under the write lock hands out consecutive AUTOINCREMENT ids ending at lastrowid
+        clones = []
+        if cloned:
+            clones = db.session.execute(db.select(Course.id, Course.time, Course.capacity).where(
+                Course.id.between(result.lastrowid - cloned + 1, result.lastrowid))).all()
+        meetings = {}
+        batch = []
+        for course_id, course_time, _ in clones:
+            if course_time not in meetings:
+                meetings[course_time] = meeting_rows(course_time)
+            batch.extend({'course_id': course_id, 'day_mask': mask, 'start_minute': start, 'end_minute': end}
+                         for mask, start, end in meetings[course_time])
+            if len(batch) >= batch_size:
+                db.session.execute(db.insert(CourseMeeting), batch)
+                batch = []
+        if batch:
+            db.session.execute(db.insert(CourseMeeting), batch)
+        rollover_courses.drop(conn)
+        record_event('term_rolled_over', source=source, target=target, cloned=cloned, adjusted=adjusted)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    cache.clear()
+    fragment_cache.clear()
+    for course_id, _, capacity in clones:
+        seat_map.set(course_id, (capacity, 0))
+    return {'source': source, 'target': target, 'cloned': cloned, 'adjusted': adjusted, 'skipped': selected - cloned}
+
+
+@app.cli.command('rollover-term')
+@click.argument('source')
+@click.argument('target')
+@click.option('--adjustments', type=click.File('r', encoding='utf-8-sig'),
+              help='CSV of course_id,capacity,time changes applied to the clones')
+@click.option('--course-id', 'course_ids', type=int, multiple=True, help='Clone only this course (repeatable)')
+def rollover_term_command(source, target, adjustments, course_ids):
+    """Clone a term's courses into a new term"""
+    try:
+        rolled = rollover_term(source, target, course_ids or None,
+                               parse_rollover_csv(adjustments) if adjustments else None)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    print(f"Cloned {rolled['cloned']} courses from {source} into {rolled['target']} "
+          f"({rolled['adjusted']} adjusted, {rolled['skipped']} already there)")
+
+
+class TermRolloverView(BaseView):
+    """Admin page for rollover_term; CourseAdmin's 'Roll over' action opens it with courses preselected"""
+    def is_accessible(self):
+        return session.get('role') == 'admin'
+
+    def inaccessible_callback(self, name, **kwargs):
+        return redirect(url_for('login'))
+
+    @expose('/', methods=('GET', 'POST'))
+    def index(self):
+        form = request.form if request.method == 'POST' else request.args
+        course_ids = form.getlist('course_id', type=int)
+        terms = sorted(db.session.scalars(db.select(Course.term).distinct()), key=term_sort_key)
+        source = form.get('source') or (db.session.scalar(db.select(Course.term).where(Course.id == course_ids[0]))
+                                        if course_ids else app.config['CURRENT_TERM'])
+        if request.method == 'POST':
+            upload = request.files.get('adjustments')
+            try:
+                adjustments = None
+                if upload and upload.filename:
+                    adjustments = parse_rollover_csv(io.StringIO(upload.read().decode('utf-8-sig')))
+                rolled = rollover_term(source, form.get('target'), course_ids or None, adjustments)
+            except (UnicodeDecodeError, ValueError) as exc:
+                flash(str(exc), 'error')
+            else:
+                flash(f"Cloned {rolled['cloned']} courses from {source} into {rolled['target']} "
+                      f"({rolled['adjusted']} adjusted, {rolled['skipped']} already there).", 'success')
+                return redirect(url_for('.index'))
+        return self.render('admin/rollover.html', terms=terms, source=source, target=form.get('target', ''),
+                           course_ids=course_ids, columns=ROLLOVER_CSV_COLUMNS)
+
+
+admin.add_view(TermRolloverView(name='Term Rollover', endpoint='rollover', url='/admin/terms/rollover'))
+
+
+#==================== Sharding ====================
+#with ENROLLMENT_SHARDS set, a course lives in shard course_id % N together with its
+#meetings and enrollments, so enrollment writes for different courses go to different
+#SQLite files (and different write locks). Student-wide reads (the dashboard, the
+#schedule used for conflict checks) are scattered to every shard in parallel and gathered.
+#Other reads (transcripts, term totals, the catalog audit, the schedule builder, roster
+#exports) are routed too; the Course/Enrollment admin views, the gradebook export, term
+#archiving and term rollover refuse to run rather than act on the main database's stale copy.
+
+SHARDED_TABLES = (Course.__table__, CourseMeeting.__table__, Enrollment.__table__)
+SHARD_ID_BLOCK = 1 << 40  #enrollments created in shard k get ids from (k + 1) * SHARD_ID_BLOCK
+
+
+def teacher_names(teacher_ids):
+    """{user id: full name} from the main database, which owns the users table"""
+    if not teacher_ids:
+        return {}
+    return dict(db.session.execute(db.select(User.id, User.full_name).where(User.id.in_(teacher_ids))).all())
+
+
+class ShardRouter:
+    """Routes course and enrollment statements to the shard owning the course"""
+
+    def __init__(self, urls):
+        self.engines = [create_engine(url) for url in urls]
+        self._pool = ThreadPoolExecutor(max_workers=len(urls), thread_name_prefix='shard')
+
+    def __len__(self):
+        return len(self.engines)
+
+    def shard_of(self, course_id):
+        return course_id % len(self.engines)
+
+    def engine_for(self, course_id):
+        return self.engines[self.shard_of(course_id)]
+
+    def gather(self, stmt):
+        """Run a read on every shard in parallel and concatenate the rows"""
+        def run(engine):
+            with engine.connect() as conn:
+                return conn.execute(stmt).all()
+        return [row for rows in self._pool.map(run, self.engines) for row in rows]
+
+    def create_all(self):
+        """Create the sharded tables and give each shard its own range of new enrollment ids"""
+        for shard, engine in enumerate(self.engines):
+            db.metadata.create_all(engine, tables=SHARDED_TABLES)
+            floor = (shard + 1) * SHARD_ID_BLOCK
+            with engine.begin() as conn:
+                updated = conn.execute(db.text("UPDATE sqlite_sequence SET seq = max(seq, :floor) WHERE name = 'enrollments'"),
+                                       {'floor': floor}).rowcount
+                if not updated:
+                    conn.execute(db.text("INSERT INTO sqlite_sequence (name, seq) VALUES ('enrollments', :floor)"),
+                                 {'floor': floor})
+
+    def copy_from_main(self, batch_size=5000):
+        """Copy courses, meetings and enrollments from the main database into their shards (existing ids are skipped)"""
+        self.create_all()
+        copied = {table.name: 0 for table in SHARDED_TABLES}
+        for table in SHARDED_TABLES:
+            course_column = table.c.id if table is Course.__table__ else table.c.course_id
+            for shard, engine in enumerate(self.engines):
+                rows = stream_rows(db.select(table).where(course_column % len(self.engines) == shard), batch_size)
+                while True:
+                    batch = [dict(zip(table.c.keys(), row)) for row in itertools.islice(rows, batch_size)]
+                    if not batch:
+                        break
+                    with engine.begin() as conn:
+                        copied[table.name] += conn.execute(table.insert().prefix_with('OR IGNORE'), batch).rowcount
+        return copied
+
+    #---------- reads ----------
+
+    def load_catalog(self, teacher_id=None, course_names=None):
+        stmt = (db.select(Course.id, Course.course_name, Course.teacher_id, Course.time, Course.capacity,
+                          db.func.count(Enrollment.id))
+                .outerjoin(Enrollment, Enrollment.course_id == Course.id)
+                .where(Course.term == app.config['CURRENT_TERM'])
+                .group_by(Course.id))
+        if teacher_id is not None:
+            stmt = stmt.where(Course.teacher_id == teacher_id)
+        if course_names is not None:
+            stmt = stmt.where(Course.course_name.in_(course_names))
+        rows = sorted(self.gather(stmt))
+        names = teacher_names({row.teacher_id for row in rows})
+        return [CourseSummary(course_id, course_name, names.get(teacher, ''), course_time, capacity, enrolled)
+                for course_id, course_name, teacher, course_time, capacity, enrolled in rows]
+
+    def student_schedule(self, student_id, term=None):
+        """(enrollment id, course id, course name, time) for every course the student takes (in term), across shards"""
+        stmt = (db.select(Enrollment.id, Course.id, Course.course_name, Course.time)
+                .join(Course, Enrollment.course_id == Course.id)
+                .where(Enrollment.student_id == student_id))
+        if term is not None:
+            stmt = stmt.where(Course.term == term)
+        return sorted(self.gather(stmt))
+
+    def student_grades(self, student_id):
+        """(term, course name, instructor name, grade, False) for the student's active-term courses, across shards"""
+        rows = self.gather(db.select(Course.term, Course.course_name, Course.teacher_id, Enrollment.grade)
+                           .join(Enrollment, Enrollment.course_id == Course.id)
+                           .where(Enrollment.student_id == student_id))
+        names = teacher_names({teacher_id for _, _, teacher_id, _ in rows})
+        return [(term, course_name, names.get(teacher_id, ''), grade, False)
+                for term, course_name, teacher_id, grade in rows]
+
+    def term_totals(self):
+        """(term, courses, enrollments, average grade, False) per active term, summed over the shards"""
+        totals = {}
+        for term, courses, enrollments, grade_sum, graded in self.gather(
+                db.select(Course.term, db.func.count(db.distinct(Course.id)), db.func.count(Enrollment.id),
+                          db.func.sum(Enrollment.grade), db.func.count(Enrollment.grade))
+                .outerjoin(Enrollment, Enrollment.course_id == Course.id)
+                .group_by(Course.term)):
+            total = totals.setdefault(term, [0, 0, 0.0, 0])
+            for i, value in enumerate((courses, enrollments, grade_sum or 0.0, graded)):
+                total[i] += value
+        return [(term, courses, enrollments, grade_sum / graded if graded else None, False)
+                for term, (courses, enrollments, grade_sum, graded) in totals.items()]
+
+    def roster_rows(self, course_id):
+        """(student name, username, grade) rows for a roster export, ordered like roster_query"""
+        with self.engine_for(course_id).connect() as conn:
+            enrollments = conn.execute(db.select(Enrollment.id, Enrollment.student_id, Enrollment.grade)
+                                       .where(Enrollment.course_id == course_id)).all()
+        students = {user_id: (full_name, username) for user_id, full_name, username in db.session.execute(
+            db.select(User.id, User.full_name, User.username)
+            .where(User.id.in_({student_id for _, student_id, _ in enrollments})))}
+        rows = sorted((*students.get(student_id, ('', '')), enrollment_id, grade)
+                      for enrollment_id, student_id, grade in enrollments)
+        return [(full_name, username, grade) for full_name, username, _, grade in rows]
+
+    def course_owner(self, course_id):
+        with self.engine_for(course_id).connect() as conn:
+            return conn.scalar(db.select(Course.teacher_id).where(Course.id == course_id))
+
+    def enrollment_owner(self, enrollment_id):
+        """(course_id, teacher_id) for an enrollment; the id does not say which shard holds it, so ask all"""
+        rows = self.gather(db.select(Enrollment.course_id, Course.teacher_id)
+                           .join(Course, Enrollment.course_id == Course.id)
+                           .where(Enrollment.id == enrollment_id))
+        return tuple(rows[0]) if rows else None
+
+    def roster(self, course_id):
+        with self.engine_for(course_id).connect() as conn:
+            rows = conn.execute(db.select(Enrollment.id, Enrollment.student_id, Enrollment.grade)
+                                .where(Enrollment.course_id == course_id).order_by(Enrollment.id)).all()
+        names = teacher_names({student_id for _, student_id, _ in rows})
+        return [RosterEntry(enrollment_id, names.get(student_id, ''), grade) for enrollment_id, student_id, grade in rows]
+
+    def course_stats(self, course_id):
+        with self.engine_for(course_id).connect() as conn:
+            return conn.execute(db.select(db.func.count(Enrollment.id), db.func.avg(Enrollment.grade))
+                                .where(Enrollment.course_id == course_id)).one()
+
+    #---------- writes ----------
+
+    def enroll(self, student_id, course_id):
+        """
+        Same checks as the single-database route; returns None or (error, status)
+        The student's schedule in the course's term is read from every shard first, then the write is one
+        transaction on the course's shard
+        """
+        if course_id is None:
+            return 'Course not found', 404
+        with self.engine_for(course_id).connect() as conn:
+            term = conn.scalar(db.select(Course.term).where(Course.id == course_id))
+        if term is None:
+            return 'Course not found', 404
+        schedule = self.student_schedule(student_id, term)
+        with self.engine_for(course_id).begin() as conn:
+            course = conn.execute(db.select(Course.time, Course.capacity).where(Course.id == course_id)).first()
+            if course is None:
+                return 'Course not found', 404
+            enrolled = conn.scalar(db.select(db.func.count(Enrollment.id)).where(Enrollment.course_id == course_id))
+            if enrolled >= course.capacity:
+                return 'Course is full', 400
+            if any(other_id == course_id for _, other_id, _, _ in schedule):
+                return 'Already enrolled', 400
+            for _, _, other_name, other_time in schedule:
+                if has_time_conflict(course.time, other_time):
+                    return f'Time conflict with {other_name}', 400
+            if not conn.execute(enrollment_insert(student_id, course_id)).rowcount:
+                return refused_enrollment_error(conn, student_id, course_id), 400
+        return None
+
+    def unenroll(self, student_id, course_id):
+        """Delete the student's enrollment in the course's shard; returns its id, or None if there was none"""
+        if course_id is None:
+            return None
+        with self.engine_for(course_id).begin() as conn:
+            enrollment_id = conn.scalar(db.select(Enrollment.id).where(
+                Enrollment.student_id == student_id, Enrollment.course_id == course_id))
+            if enrollment_id is not None:
+                conn.execute(db.delete(Enrollment).where(Enrollment.id == enrollment_id))
+        return enrollment_id
+
+    def update_grade(self, course_id, enrollment_id, grade):
+        """Set a grade in the course's shard; returns the number of rows updated (0 if it was deleted)"""
+        with self.engine_for(course_id).begin() as conn:
+            return conn.execute(db.update(Enrollment).where(Enrollment.id == enrollment_id).values(grade=grade)).rowcount
+
+
+shard_router = ShardRouter(app.config['ENROLLMENT_SHARDS']) if app.config['ENROLLMENT_SHARDS'] else None
 
-    # Check if they share any days
-    if not days1.intersection(days2):
-        return False
 
-    # Check if times overlap (conflict if one starts before the other ends)
-    return not (end1 <= start2 or end2 <= start1)
+@app.cli.command('shard-data')
+def shard_data_command():
+    """Create the shard databases and copy courses, meetings and enrollments into them"""
+    if shard_router is None:
+        raise click.ClickException('Set ENROLLMENT_SHARDS to a comma-separated list of database URLs first')
+    for table, count in shard_router.copy_from_main().items():
+        print(f'Copied {count} {table} rows into {len(shard_router)} shards')
+
+
+#==================== Background Jobs ====================
+#follow-up work for a write (re-warming course stats, notifications, audit rows) is
+#inserted into the jobs table inside the write's own transaction, so it commits or
+#rolls back with it, and runs after the response on the job worker's threads
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+    """Register a function as the handler for jobs of this kind (payload is passed as keyword arguments)"""
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+def job_statement(kind, payload=None, key=None, priority=0, delay=0):
+    """INSERT for a new job; a no-op when a job with the same key is already pending"""
+    now = time.time()
+    return db.insert(Job).prefix_with('OR IGNORE').values(
+        kind=kind, key=key, payload=json.dumps(payload or {}), priority=priority, status='pending',
+        attempts=0, max_attempts=app.config['JOB_MAX_ATTEMPTS'], run_after=now + delay, created_at=now)
+
+
+def enqueue_job(kind, payload=None, key=None, priority=0, delay=0):
+    """Queue a job in the current transaction; workers see it once the caller commits"""
+    db.session.execute(job_statement(kind, payload, key, priority, delay))
+    db.session.info['jobs_enqueued'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def wake_job_worker(session):
+    if session.info.pop('jobs_enqueued', False):
+        job_worker.wake()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_enqueued_jobs(session):
+    session.info.pop('jobs_enqueued', None)
+
+
+def claim_job():
+    """Mark the highest-priority due job as running and return it, or None when nothing is due"""
+    while True:
+        now = time.time()
+        job_id = db.session.scalar(
+            db.select(Job.id)
+            .where(Job.status == 'pending', Job.run_after <= now)
+            .order_by(Job.priority.desc(), Job.id)
+            .limit(1)
+        )
+        if job_id is None:
+            db.session.rollback()
+            return None
+        #another worker may claim the same row first; only one UPDATE matches
+        claimed = db.session.execute(
+            db.update(Job).where(Job.id == job_id, Job.status == 'pending')
+            .values(status='running', started_at=now, attempts=Job.attempts + 1)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+
+
+def finish_job(job_id, error=None):
+    """Record a job's outcome: done, retried later with exponential backoff, or failed for good"""
+    job = db.session.get(Job, job_id)
+    now = time.time()
+    if error is None:
+        job.status, job.finished_at, job.last_error = 'done', now, None
+    elif job.attempts < job.max_attempts:
+        job.status, job.last_error = 'pending', error
+        job.run_after = now + app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+    else:
+        job.status, job.finished_at, job.last_error = 'failed', now, error
+    try:
+        db.session.commit()
+    except IntegrityError:
+        #a newer job with the same key is already pending and will redo this work
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.status, job.finished_at, job.last_error = 'done', now, f'{error} (superseded by a pending job)'
+        db.session.commit()
+    return job
+
+
+def recover_stale_jobs(lease=None):
+    """
+    Requeue jobs left 'running' by a worker that stopped mid-job; returns how many were requeued
+    Only jobs started more than JOB_LEASE_TIMEOUT seconds ago, so jobs other processes are still running stay put
+    """
+    cutoff = time.time() - (app.config['JOB_LEASE_TIMEOUT'] if lease is None else lease)
+    requeued = db.session.execute(
+        db.update(Job).where(Job.status == 'running', Job.started_at < cutoff).values(status='pending')
+    ).rowcount
+    db.session.commit()
+    return requeued
+
+
+def prune_jobs(older_than=None):
+    """Delete finished jobs older than JOB_RETENTION seconds; returns how many were removed"""
+    cutoff = time.time() - (app.config['JOB_RETENTION'] if older_than is None else older_than)
+    removed = db.session.execute(
+        db.delete(Job).where(Job.status.in_(('done', 'failed')), Job.finished_at < cutoff)
+    ).rowcount
+    db.session.commit()
+    return removed
+
+
+class JobWorker:
+    """Thread pool that claims due jobs by priority and runs them inside an app context"""
+
+    def __init__(self, threads):
+        self.threads = threads
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._last_prune = 0.0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=1000)  #seconds from enqueue to finish of recent jobs
+
+    def start(self):
+        """Start the worker threads (once); does nothing when JOB_WORKERS is 0"""
+        if self._workers or not self.threads:
+            return
+        with app.app_context():
+            recover_stale_jobs()
+        self._stop.clear()
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._loop, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._workers.append(thread)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._workers:
+            thread.join(timeout)
+        self._workers = []
+
+    def wake(self):
+        """Tell idle workers a job was just committed"""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with app.app_context():
+                ran = self.run_once()
+                if not ran and time.time() - self._last_prune > 60:
+                    self._last_prune = time.time()
+                    recover_stale_jobs()
+                    prune_jobs()
+                    prune_sessions()
+            if not ran:
+                self._wake.wait(app.config['JOB_POLL_INTERVAL'])
+                self._wake.clear()
+
+    def run_once(self):
+        """Claim and run one due job; returns False when the queue has nothing due"""
+        job = claim_job()
+        if job is None:
+            return False
+        job_id, created_at = job.id, job.created_at
+        handler = JOB_HANDLERS.get(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f'No handler registered for job kind {job.kind!r}')
+            handler(**json.loads(job.payload))
+            db.session.commit()
+            error = None
+        except Exception as exc:
+            db.session.rollback()
+            error = f'{type(exc).__name__}: {exc}'
+        job = finish_job(job_id, error)
+
+        with self._lock:
+            if job.status == 'done':
+                self.completed += 1
+                self.latencies.append(job.finished_at - created_at)
+            elif job.status == 'failed':
+                self.failed += 1
+            else:
+                self.retried += 1
+        return True
+
+    def drain(self):
+        """Run due jobs on the calling thread until none are left; returns how many ran"""
+        ran = 0
+        while self.run_once():
+            ran += 1
+        return ran
+
+    def stats(self):
+        """Queue depth per status and kind, plus this process's job latency and failure counters"""
+        depth = dict(db.session.execute(db.select(Job.status, db.func.count(Job.id)).group_by(Job.status)).all())
+        pending = dict(db.session.execute(
+            db.select(Job.kind, db.func.count(Job.id)).where(Job.status == 'pending').group_by(Job.kind)).all())
+        oldest = db.session.scalar(db.select(db.func.min(Job.created_at)).where(Job.status == 'pending'))
+        with self._lock:
+            latencies = sorted(self.latencies)
+            counters = {'completed': self.completed, 'retried': self.retried, 'failed': self.failed}
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 1) if latencies else None
+
+        return {
+            'workers': len(self._workers),
+            'queue_depth': depth.get('pending', 0),
+            'pending_by_kind': pending,
+            'running': depth.get('running', 0),
+            'failed_total': depth.get('failed', 0),
+            'oldest_pending_age_s': round(time.time() - oldest, 1) if oldest else None,
+            'latency_ms': {'p50': pct(50), 'p99': pct(99), 'samples': len(latencies)},
+            'process': counters,
+        }
+
+
+job_worker = JobWorker(app.config['JOB_WORKERS'])
+
+
+def refresh_course_job(course_id):
+    """(kind, payload, key) for the job that re-warms a course's cached reads after a write"""
+    return 'refresh_course_stats', {'course_id': course_id}, f'course_stats:{course_id}'
+
+
+@job_handler('refresh_course_stats')
+def refresh_course_stats(course_id):
+    """Recompute a course's stats and its teacher's course list so the next page view is a cache hit"""
+    cache.delete(('course_stats', course_id))
+    get_course_stats(course_id)
+    teacher_id = course_owner(course_id)
+    if teacher_id is not None:
+        get_teacher_courses(teacher_id)
+
+
+def affected_course_ids(model):
+    """Courses whose cached reads an admin edit of this model changes"""
+    if isinstance(model, Course):
+        return {model.id}
+    if isinstance(model, Enrollment):
+        moved_from = inspect(model).attrs.course_id.history.deleted or ()
+        return {model.course_id, *moved_from} - {None}
+    return set()
+
+
+@app.cli.command('run-jobs')
+@click.option('--drain', is_flag=True, help='Run due jobs once and exit instead of polling forever.')
+def run_jobs_command(drain):
+    """Run the background job worker in this process"""
+    if drain:
+        recover_stale_jobs()
+        print(f'Ran {job_worker.drain()} job(s)')
+        return
+    job_worker.start()
+    print(f'Job worker running with {job_worker.threads} thread(s); Ctrl-C to stop')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        job_worker.stop()
+
+
+#==================== Backup and Restore ====================
+#SQLite's online backup API copies the live database page by page while the app keeps
+#serving. In WAL mode the copier pins one read snapshot for the whole copy, so writers
+#carry on and the backup is consistent without restarting. In rollback-journal mode each
+#write from another connection restarts the copy; after BACKUP_MAX_RESTARTS the rest is
+#copied in one step, which blocks writers only for that step.
+
+BACKUP_REQUIRED_TABLES = ('users', 'courses', 'enrollments')
+
+
+class BackupRestarted(Exception):
+    """Raised from the progress callback to stop an incremental copy that keeps restarting"""
+
+
+def database_path():
+    """Filesystem path of the main database; online backup needs a SQLite file"""
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        raise ValueError('Online backup needs a file-backed SQLite database')
+    return url.database
+
+
+def copy_database(source, target, pages, pause, max_restarts):
+    """
+    Copy one sqlite3 connection's database into another, pages at a time, sleeping between steps
+    Returns how many times concurrent writes restarted the copy
+    """
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        #every successful step copies pages, so no progress means a write sent the copy back to page 1
+        if last_remaining is not None and remaining >= last_remaining and status not in (
+                sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+            restarts += 1
+            if restarts > max_restarts:
+                raise BackupRestarted
+        last_remaining = remaining
+        if remaining and pause:
+            time.sleep(pause)
+
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    except BackupRestarted:
+        source.backup(target)
+    return restarts
+
+
+def verify_backup(path):
+    """Integrity-check a backup and count its rows per table; raises ValueError if it is unusable"""
+    if not os.path.isfile(path):
+        raise ValueError(f'No such backup: {path}')
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        problems = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+        if problems != ['ok']:
+            raise ValueError(f'Backup {path} failed the integrity check: ' + '; '.join(problems[:5]))
+        tables = [name for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+        missing = [name for name in BACKUP_REQUIRED_TABLES if name not in tables]
+        if missing:
+            raise ValueError(f'Backup {path} is missing tables: {", ".join(missing)}')
+        counts = {name: conn.execute(f'SELECT count(*) FROM "{name}"').fetchone()[0] for name in tables}
+    except sqlite3.DatabaseError as exc:
+        raise ValueError(f'Backup {path} is not a readable SQLite database: {exc}')
+    finally:
+        conn.close()
+    return {'path': path, 'bytes': os.path.getsize(path), 'tables': counts}
+
+
+def backup_database(target=None, pages=None, pause=None):
+    """
+    Copy the live database to target (default: a timestamped file in BACKUP_DIR) without stopping the app
+    The copy is written to target + '.part' and renamed only once it passes verify_backup
+    """
+    source_path = database_path()
+    if target is None:
+        os.makedirs(app.config['BACKUP_DIR'], exist_ok=True)
+        target = os.path.join(app.config['BACKUP_DIR'], time.strftime('enrollment-%Y%m%d-%H%M%S.db'))
+    partial = target + '.part'
+    started = time.monotonic()
+
+    source = sqlite3.connect(source_path, isolation_level=None)
+    dest = sqlite3.connect(partial)
+    try:
+        if source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+            #pin a snapshot: every step reads the same version of the database
+            source.execute('BEGIN')
+            source.execute('SELECT count(*) FROM sqlite_master').fetchone()
+        restarts = copy_database(source, dest,
+                                 pages or app.config['BACKUP_PAGES'],
+                                 app.config['BACKUP_PAUSE'] if pause is None else pause,
+                                 app.config['BACKUP_MAX_RESTARTS'])
+        #the copy inherits the live file's WAL flag; a backup should be one self-contained file
+        dest.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        dest.close()
+        source.close()
+
+    try:
+        report = verify_backup(partial)
+    except ValueError:
+        os.remove(partial)
+        raise
+    os.replace(partial, target)
+    report.update(path=target, restarts=restarts, seconds=round(time.monotonic() - started, 3))
+    return report
+
+
+def restore_database(path):
+    """
+    Replace the live database with a verified backup
+    The copy runs as one step under an exclusive lock, so other connections see either the old or the restored data
+    """
+    report = verify_backup(path)
+    source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    target = sqlite3.connect(database_path(), timeout=30)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    #pooled connections notice the file changed on their next read; only the caches need dropping
+    db.session.remove()
+    cache.clear()
+    fragment_cache.clear()
+    ownership_cache.clear()
+    seat_map.clear()
+    return report
+
+
+def list_backups():
+    """Finished backups in BACKUP_DIR, newest first"""
+    folder = app.config['BACKUP_DIR']
+    if not os.path.isdir(folder):
+        return []
+    backups = [entry for entry in os.scandir(folder) if entry.is_file() and entry.name.endswith('.db')]
+    backups.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [{'name': entry.name, 'bytes': entry.stat().st_size,
+             'created': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.stat().st_mtime))}
+            for entry in backups]
+
+
+@job_handler('backup_database')
+def backup_job(target=None):
+    backup_database(target)
+
+
+@app.cli.command('backup')
+@click.argument('target', required=False)
+def backup_command(target):
+    """Copy the live database to TARGET (default: a timestamped file in BACKUP_DIR) while the app runs"""
+    try:
+        report = backup_database(target)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    print(f"Backed up {report['bytes']} bytes to {report['path']} in {report['seconds']}s "
+          f"({report['restarts']} restarts)")
+
+
+@app.cli.command('verify-backup')
+@click.argument('path')
+def verify_backup_command(path):
+    """Integrity-check a backup and print its row counts"""
+    try:
+        report = verify_backup(path)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    for table, count in report['tables'].items():
+        print(f'{table:<24} {count:>10}')
+    print(f"{path}: ok, {report['bytes']} bytes")
+
+
+@app.cli.command('restore')
+@click.argument('path')
+@click.confirmation_option(prompt='Replace the live database with this backup?')
+def restore_command(path):
+    """Verify a backup and copy it over the live database"""
+    try:
+        report = restore_database(path)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    print(f"Restored {path} ({sum(report['tables'].values())} rows); restart other app processes to drop their caches")
+
+
+@app.route('/admin/backup', methods=['GET', 'POST'])
+@api_role_required('admin')
+def database_backups():
+    """POST queues an online backup on the job queue; GET lists finished backups (admins only)"""
+    if request.method == 'POST':
+        #the job key makes repeated clicks queue a single backup
+        enqueue_job('backup_database', key='backup_database', priority=-10)
+        db.session.commit()
+        return jsonify({'queued': True}), 202
+    in_progress = db.session.scalar(db.select(db.func.count(Job.id)).where(
+        Job.kind == 'backup_database', Job.status.in_(('pending', 'running'))))
+    return jsonify({'in_progress': bool(in_progress), 'backups': list_backups()}), 200
+
+
+#==================== Sessions ====================
+#the session cookie holds only a random id; the session lives in the sessions table and the
+#user's name and role are read from users when it is loaded, so UserAdmin edits reach signed-in
+#users and a user's sessions can be revoked. Loads go through a per-process LRU front cache
+
+USER_SESSION_KEYS = ('user_id', 'username', 'full_name', 'role')  #filled from users, never stored in data
+
+session_cache = CACHE_BACKENDS[app.config['CACHE_BACKEND']](
+    max_entries=app.config['SESSION_CACHE_MAX_ENTRIES'], ttl=app.config['SESSION_CACHE_TTL'])
+
+
+def new_session_id():
+    return secrets.token_urlsafe(32)
+
+
+def session_lookup(sid):
+    """SELECT for a stored session joined with its user's current name and role"""
+    return (db.select(UserSession.expires_at, UserSession.data, User.id, User.username, User.full_name, User.role)
+            .outerjoin(User, User.id == UserSession.user_id)
+            .where(UserSession.id == sid))
+
+
+def session_record(row):
+    """Front-cache entry (expires_at, user context or None, data) for a session_lookup row, None if there is none"""
+    if row is None:
+        return None
+    expires_at, data, user_id, username, full_name, role = row
+    context = None if user_id is None else {'user_id': user_id, 'username': username, 'full_name': full_name, 'role': role}
+    return expires_at, context, data
+
+
+def session_contents(record):
+    """Session dict for a front-cache entry; {} when missing or expired"""
+    if record is None or record[0] < time.time():
+        return {}
+    expires_at, context, data = record
+    contents = dict(context or ())
+    if data != '{}':
+        contents.update(session_json_serializer.loads(data))
+    return contents
+
+
+def session_insert(sid, user_id, data, expires_at):
+    """INSERT creating a session (expired rows are swept by the job worker, see prune_sessions)"""
+    return db.insert(UserSession).values(id=sid, user_id=user_id, data=data, created_at=time.time(),
+                                         expires_at=expires_at)
+
+
+def stored_session_data(contents):
+    """Tagged JSON of the keys kept in the data column"""
+    return session_json_serializer.dumps({key: value for key, value in contents.items() if key not in USER_SESSION_KEYS})
+
+
+def load_session_record(sid):
+    """Front-cache entry for a session id, read from the table on a miss (misses are cached too)"""
+    record = session_cache.get(sid, _MISSING)
+    if record is _MISSING:
+        with db.engine.connect() as conn:
+            record = session_record(conn.execute(session_lookup(sid)).first())
+        session_cache.set(sid, record)
+    return record
+
+
+class ServerSession(SecureCookieSession):
+    """Session dict that remembers its id and the user it was loaded for"""
+
+    def __init__(self, initial=None, sid=None, expires_at=0.0):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.loaded_user_id = (initial or {}).get('user_id')
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Flask session interface over the sessions table
+    A new id is issued whenever the signed-in user changes (login, logout), so ids cannot be fixed in advance
+    """
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return ServerSession()
+        record = load_session_record(sid)
+        contents = session_contents(record)
+        if not contents:
+            return ServerSession()
+        return ServerSession(contents, sid=sid, expires_at=record[0])
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        cookie = {'domain': self.get_cookie_domain(app), 'path': self.get_cookie_path(app),
+                  'secure': self.get_cookie_secure(app), 'samesite': self.get_cookie_samesite(app),
+                  'httponly': self.get_cookie_httponly(app)}
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.sid is not None:
+                with db.engine.begin() as conn:
+                    conn.execute(db.delete(UserSession).where(UserSession.id == session.sid))
+                session_cache.delete(session.sid)
+                response.delete_cookie(name, **cookie)
+            return
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        rotate = session.sid is None or session.get('user_id') != session.loaded_user_id
+        #unchanged sessions cost no write until half their lifetime has passed
+        if not rotate and not session.modified and session.expires_at - now > lifetime / 2:
+            return
+
+        sid = new_session_id() if rotate else session.sid
+        expires_at = now + lifetime
+        data = stored_session_data(session)
+        with db.engine.begin() as conn:
+            if rotate:
+                if session.sid is not None:
+                    conn.execute(db.delete(UserSession).where(UserSession.id == session.sid))
+                conn.execute(session_insert(sid, session.get('user_id'), data, expires_at))
+            elif not conn.execute(db.update(UserSession).where(UserSession.id == sid)
+                                  .values(data=data, expires_at=expires_at)).rowcount:
+                sid = None  #revoked while this request ran; do not bring it back
+        if session.sid is not None:
+            session_cache.delete(session.sid)
+        if sid is None:
+            response.delete_cookie(name, **cookie)
+            return
+
+        context = {key: session[key] for key in USER_SESSION_KEYS if key in session} if 'user_id' in session else None
+        session_cache.set(sid, (expires_at, context, data))
+        response.set_cookie(name, sid, expires=self.get_expiration_time(app, session), **cookie)
+        response.vary.add('Cookie')
+
+
+app.session_interface = ServerSessionInterface()
+
+
+def user_session_ids(user_id):
+    return db.session.scalars(db.select(UserSession.id).where(UserSession.user_id == user_id)).all()
+
+
+def revoke_user_sessions(user_id):
+    """
+    Delete every session of a user in the caller's transaction; returns their ids, which the
+    caller evicts from session_cache after commit (other processes drop them within SESSION_CACHE_TTL)
+    """
+    sids = user_session_ids(user_id)
+    db.session.execute(db.delete(UserSession).where(UserSession.user_id == user_id))
+    return sids
+
+
+def evict_sessions(sids):
+    for sid in sids:
+        session_cache.delete(sid)
+
+
+def prune_sessions():
+    """Delete expired sessions; the job worker runs this with prune_jobs while idle"""
+    removed = db.session.execute(db.delete(UserSession).where(UserSession.expires_at < time.time())).rowcount
+    db.session.commit()
+    return removed
+
+
+@app.cli.command('revoke-sessions')
+@click.argument('username')
+def revoke_sessions_command(username):
+    """Sign a user out everywhere"""
+    user_id = db.session.scalar(db.select(User.id).where(User.username == username))
+    if user_id is None:
+        raise click.ClickException(f'No user named {username}')
+    sids = revoke_user_sessions(user_id)
+    db.session.commit()
+    evict_sessions(sids)
+    print(f'Revoked {len(sids)} sessions for {username}')
+
+
+#==================== Event Log ====================
+#append-only record of every enrollment, grade and admin mutation: JSON lines numbered by
+#a gap-free seq, in segment files named after their first seq (events-<seq>.jsonl), so a
+#consumer can resume from the last seq it applied. Segments are only ever appended to,
+#under an exclusive file lock shared by every process writing to the directory
+
+EVENT_SEGMENT_PATTERN = re.compile(r'^events-(\d{20})\.jsonl$')
+EVENT_REDACTED_COLUMNS = {'password_hash'}
+
+
+def new_event(kind, actor=None, **fields):
+    """Event dict (the log adds seq); actor is the signed-in user id, None for CLI and jobs"""
+    return {'ts': round(time.time(), 6), 'kind': kind, 'actor': actor, **fields}
+
+
+def event_outbox_insert(event):
+    """INSERT staging an event in the current transaction (strict mode)"""
+    return db.insert(EventOutbox).values(event=json.dumps(event, separators=(',', ':')))
+
+
+class EventLog:
+    """Batched appender and reader for the segment files in one directory"""
+
+    def __init__(self, path, mode='batched', segment_bytes=64 * 1024 * 1024, batch_size=1000, flush_interval=0.5):
+        self.path = path
+        self.mode = mode
+        self.segment_bytes = segment_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = deque()
+        self._lock = threading.Lock()  #guards the buffer and the flusher thread
+        self._flush_lock = threading.Lock()  #one flush at a time in this process
+        self._wake = threading.Event()
+        self._thread = None
+        self.appended = 0
+        self.flushes = 0
+
+    @property
+    def enabled(self):
+        return self.mode in ('batched', 'strict')
+
+    #---------- writes ----------
+
+    def append(self, events):
+        """Buffer committed events; the flusher thread writes them within flush_interval"""
+        if not events:
+            return
+        with self._lock:
+            self._buffer.extend(events)
+            full = len(self._buffer) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='event-log-flusher', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def wake(self):
+        """Relay newly committed outbox rows now (strict mode)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='event-log-flusher', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception('Event log flush failed; retrying')
+
+    def flush(self):
+        """Write buffered events, and in strict mode the outbox, to the log; returns how many were written"""
+        with self._flush_lock:
+            with self._lock:
+                events = list(self._buffer)
+                self._buffer.clear()
+            if not events and self.mode != 'strict':
+                return 0
+            try:
+                return self._write(events)
+            except Exception:
+                with self._lock:
+                    self._buffer.extendleft(reversed(events))
+                raise
+
+    def _write(self, events):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, 'LOCK'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            seq, last = self._tail()
+            relayed = None
+            if self.mode == 'strict':
+                with app.app_context(), db.engine.begin() as conn:
+                    #rows up to the last relayed one were written before a crash could delete them
+                    if last is not None and 'outbox_id' in last:
+                        conn.execute(db.delete(EventOutbox).where(EventOutbox.id <= last['outbox_id']))
+                    rows = conn.execute(db.select(EventOutbox.id, EventOutbox.event).order_by(EventOutbox.id)).all()
+                if rows:
+                    relayed = rows[-1][0]
+                    events = [dict(json.loads(event), outbox_id=outbox_id) for outbox_id, event in rows] + events
+            if not events:
+                return 0
+
+            lines = []
+            for event in events:
+                seq += 1
+                lines.append(json.dumps({'seq': seq, **event}, separators=(',', ':')).encode() + b'\n')
+            segments = self.segments()
+            first_seq = seq - len(lines) + 1
+            if not segments or os.path.getsize(segments[-1][1]) >= self.segment_bytes:
+                segment = os.path.join(self.path, f'events-{first_seq:020d}.jsonl')
+            else:
+                segment = segments[-1][1]
+            with open(segment, 'ab') as f:
+                f.write(b''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+
+            if relayed is not None:
+                with app.app_context(), db.engine.begin() as conn:
+                    conn.execute(db.delete(EventOutbox).where(EventOutbox.id <= relayed))
+        with self._lock:
+            self.appended += len(lines)
+            self.flushes += 1
+        return len(lines)
+
+    def _tail(self):
+        """(last seq, last event or None), cutting off a line left half-written by a crash"""
+        segments = self.segments()
+        if not segments:
+            return 0, None
+        first_seq, segment = segments[-1]
+        with open(segment, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            data = b''
+            while size > len(data) and data.count(b'\n') < 2:
+                block = min(64 * 1024, size - len(data))
+                f.seek(size - len(data) - block)
+                data = f.read(block) + data
+            complete = data[:data.rfind(b'\n') + 1]
+            if len(complete) < len(data):
+                f.truncate(size - (len(data) - len(complete)))
+        lines = complete.splitlines()
+        if not lines:
+            return first_seq - 1, None
+        last = json.loads(lines[-1])
+        return last['seq'], last
+
+    #---------- reads ----------
+
+    def segments(self):
+        """[(first seq, path)] oldest first"""
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted((int(match.group(1)), os.path.join(self.path, name))
+                      for name in names for match in [EVENT_SEGMENT_PATTERN.match(name)] if match)
+
+    def read(self, after=0):
+        """Events with seq above after, oldest first; stops at the end of what has been written"""
+        segments = self.segments()
+        start = 0
+        for i, (first_seq, _) in enumerate(segments):
+            if first_seq <= after + 1:
+                start = i
+        for _, segment in segments[start:]:
+            with open(segment, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        return  #still being written
+                    #lines start with {"seq":N, so skipped events are not parsed
+                    if int(line[7:line.index(b',')]) > after:
+                        yield json.loads(line)
+
+    def tail(self, after=0, poll_interval=0.5, stop=None):
+        """Follow the log: yield events above after as they are written, until stop() is true"""
+        while stop is None or not stop():
+            for event in self.read(after):
+                after = event['seq']
+                yield event
+            time.sleep(poll_interval)
+
+    def stats(self):
+        with self._lock:
+            return {'mode': self.mode, 'buffered': len(self._buffer), 'appended': self.appended,
+                    'flushes': self.flushes, 'segments': len(self.segments())}
+
+
+event_log = EventLog(app.config['EVENT_LOG_DIR'], mode=app.config['EVENT_LOG_MODE'],
+                     segment_bytes=app.config['EVENT_SEGMENT_BYTES'], batch_size=app.config['EVENT_BATCH_SIZE'],
+                     flush_interval=app.config['EVENT_FLUSH_INTERVAL'])
+atexit.register(lambda: event_log.flush() if event_log.mode == 'batched' else None)
+
+
+def record_event(kind, **fields):
+    """
+    Log a mutation made in the current db.session transaction: staged in event_outbox (strict)
+    or held until commit and then buffered (batched); a rollback drops it either way
+    """
+    if not event_log.enabled:
+        return
+    event = new_event(kind, session.get('user_id') if has_request_context() else None, **fields)
+    if event_log.mode == 'strict':
+        db.session.execute(event_outbox_insert(event))
+        db.session.info['events_outboxed'] = True
+    else:
+        db.session.info.setdefault('pending_events', []).append(event)
+
+
+def event_statements(event):
+    """Statements staging an event in a transaction run outside db.session (asgi.py); none unless strict"""
+    return [event_outbox_insert(event)] if event_log.mode == 'strict' else []
+
+
+def publish_event(event):
+    """After such a transaction commits: buffer the event (batched) or relay the outbox (strict)"""
+    if event_log.mode == 'batched':
+        event_log.append([event])
+    elif event_log.mode == 'strict':
+        event_log.wake()
+
+
+@event.listens_for(db.session, 'after_commit')
+def publish_events(session):
+    event_log.append(session.info.pop('pending_events', None))
+    if session.info.pop('events_outboxed', False):
+        event_log.wake()
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_events(session, previous_transaction):
+    session.info.pop('pending_events', None)
+    session.info.pop('events_outboxed', None)
+
+
+def column_values(model, committed=False):
+    """{column: value} of a model row for admin events, secrets left out; committed=True gives pre-edit values"""
+    state = inspect(model)
+    values = {}
+    for attr in state.mapper.column_attrs:
+        if attr.key in EVENT_REDACTED_COLUMNS:
+            continue
+        history = state.attrs[attr.key].history if committed else None
+        value = history.deleted[0] if history and history.deleted else getattr(model, attr.key)
+        values[attr.key] = float(value) if isinstance(value, Decimal) else value  #form fields hand back Decimals
+    return values
+
+
+@app.route('/admin/events')
+@api_role_required('admin')
+def event_feed():
+    """Events after ?after=<seq>, at most ?limit= of them, oldest first (admins only)"""
+    after = request.args.get('after', 0, type=int)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    event_log.flush()
+    events = list(itertools.islice(event_log.read(after), limit))
+    return jsonify({'events': events, 'next': events[-1]['seq'] if events else after,
+                    'stats': event_log.stats()}), 200
+
+
+@app.cli.command('events')
+@click.option('--after', default=0, help='Print events with a higher sequence number')
+@click.option('--follow', is_flag=True, help='Keep printing new events as they are written')
+def events_command(after, follow):
+    """Print the event log as JSON lines"""
+    events = event_log.tail(after) if follow else event_log.read(after)
+    for entry in events:
+        print(json.dumps(entry, separators=(',', ':')), flush=True)
+
+
+#==================== Idempotency Keys ====================
+#a write sent with an Idempotency-Key header claims that key for the user; its response
+#is stored, and a retry with the same key and request is answered from the table with
+#one indexed lookup instead of running the write again
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+REPLAYED_RESPONSE_HEADERS = ('Content-Type', 'Location')
+
+
+def request_fingerprint(method, path, body):
+    """Hash identifying a request, so a key reused for a different request can be refused"""
+    return hashlib.sha256(b'\n'.join((method.encode(), path.encode(), body))).hexdigest()
+
+
+def idempotency_lookup(user_id, key):
+    """SELECT for a live record: finished within the TTL, or claimed within the lock timeout"""
+    now = time.time()
+    return db.select(IdempotencyKey.__table__).where(
+        IdempotencyKey.user_id == user_id, IdempotencyKey.key == key,
+        IdempotencyKey.created_at >= now - app.config['IDEMPOTENCY_TTL'],
+        db.or_(IdempotencyKey.status_code.is_not(None),
+               IdempotencyKey.created_at >= now - app.config['IDEMPOTENCY_LOCK_TIMEOUT']))
+
+
+def idempotency_claim_statements(user_id, key, fingerprint):
+    """
+    Statements claiming a key, run in one transaction: clear an expired or abandoned record,
+    insert the claim (a no-op when another request holds the key), and schedule the TTL sweep
+    """
+    now = time.time()
+    return [
+        db.delete(IdempotencyKey).where(
+            IdempotencyKey.user_id == user_id, IdempotencyKey.key == key,
+            db.or_(IdempotencyKey.created_at < now - app.config['IDEMPOTENCY_TTL'],
+                   db.and_(IdempotencyKey.status_code.is_(None),
+                           IdempotencyKey.created_at < now - app.config['IDEMPOTENCY_LOCK_TIMEOUT']))),
+        db.insert(IdempotencyKey).prefix_with('OR IGNORE').values(
+            user_id=user_id, key=key, fingerprint=fingerprint, created_at=now),
+        job_statement('prune_idempotency_keys', key='prune_idempotency_keys', delay=app.config['IDEMPOTENCY_TTL']),
+    ]
+
+
+def idempotency_store_statement(user_id, key, status_code, headers, body):
+    """UPDATE recording the response of a claimed key"""
+    return db.update(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key).values(
+        status_code=status_code, body=body,
+        headers=json.dumps({name: headers[name] for name in REPLAYED_RESPONSE_HEADERS if name in headers}))
+
+
+def idempotency_release_statement(user_id, key):
+    """DELETE dropping a claim whose request failed, so the client may retry it"""
+    return db.delete(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+
+
+def idempotent_replay(record, fingerprint):
+    """(status, headers, body) answering a request whose key is already taken"""
+    def error(status, message):
+        return status, {'Content-Type': 'application/json'}, json.dumps({'error': message}).encode()
+
+    if record.fingerprint != fingerprint:
+        return error(422, f'{IDEMPOTENCY_HEADER} was already used for a different request')
+    if record.status_code is None:
+        status, headers, body = error(409, f'A request with this {IDEMPOTENCY_HEADER} is still in progress')
+        headers['Retry-After'] = '1'
+        return status, headers, body
+    headers = json.loads(record.headers)
+    headers[REPLAYED_HEADER] = 'true'
+    return record.status_code, headers, record.body
+
+
+def commit_response(response):
+    """
+    Commit a write view's transaction and return its response; under @idempotent the response is
+    stored in that same transaction, so no crash can leave the write committed with its key unanswered
+    """
+    response = make_response(response)
+    claim = g.pop('idempotency_claim', None)
+    if claim is not None:
+        db.session.execute(idempotency_store_statement(
+            *claim, response.status_code, response.headers, response.get_data()))
+        g.idempotency_stored = True
+    db.session.commit()
+    return response
+
+
+def idempotent(view):
+    """
+    Write-route decorator (inside the role check): honour an Idempotency-Key header by
+    replaying the stored response for a repeated request; 5xx responses are not stored
+    Views that write commit through commit_response; responses of requests that wrote nothing are stored here
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 200:
+            return jsonify({'error': f'{IDEMPOTENCY_HEADER} must be at most 200 characters'}), 400
+
+        user_id = session['user_id']
+        fingerprint = request_fingerprint(request.method, request.path, request.get_data())
+        record = db.session.execute(idempotency_lookup(user_id, key)).first()
+        if record is None:
+            claimed = [db.session.execute(stmt) for stmt in idempotency_claim_statements(user_id, key, fingerprint)]
+            db.session.commit()
+            if not claimed[1].rowcount:
+                record = db.session.execute(idempotency_lookup(user_id, key)).first()
+        if record is not None:
+            status, headers, body = idempotent_replay(record, fingerprint)
+            return Response(body, status=status, headers=headers)
+
+        g.idempotency_claim = (user_id, key)
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            g.pop('idempotency_claim', None)
+            if not g.pop('idempotency_stored', False):
+                db.session.execute(idempotency_release_statement(user_id, key))
+                db.session.commit()
+            raise
+        if g.pop('idempotency_stored', False):
+            return response
+        g.pop('idempotency_claim', None)
+        if response.status_code >= 500:
+            db.session.execute(idempotency_release_statement(user_id, key))
+        else:
+            db.session.execute(idempotency_store_statement(
+                user_id, key, response.status_code, response.headers, response.get_data()))
+        db.session.commit()
+        return response
+    return wrapper
+
+
+@job_handler('prune_idempotency_keys')
+def prune_idempotency_keys():
+    """Delete stored responses older than IDEMPOTENCY_TTL"""
+    db.session.execute(db.delete(IdempotencyKey).where(
+        IdempotencyKey.created_at < time.time() - app.config['IDEMPOTENCY_TTL']))
 
 
 #==================== API Routes ====================
 
+def enrollment_insert(student_id, course_id):
+    """
+    INSERT of one enrollment that only happens if the course still has a free seat and the
+    student is not already in it. Checked and written in one statement, so simultaneous
+    requests cannot overbook a course or enroll a student twice; rowcount 0 means refused.
+    """
+    enrolled = db.select(db.func.count(Enrollment.id)).where(Enrollment.course_id == course_id).scalar_subquery()
+    capacity = db.select(Course.capacity).where(Course.id == course_id).scalar_subquery()
+    duplicate = db.exists().where(Enrollment.student_id == student_id, Enrollment.course_id == course_id)
+    return db.insert(Enrollment).from_select(
+        ['student_id', 'course_id'],
+        db.select(db.literal(student_id), db.literal(course_id)).where(enrolled < capacity, ~duplicate))
+
+
+def refused_enrollment_error(conn, student_id, course_id):
+    """Why enrollment_insert wrote nothing: the student got in first, or the last seat went"""
+    duplicate = conn.scalar(db.select(Enrollment.id).where(
+        Enrollment.student_id == student_id, Enrollment.course_id == course_id))
+    return 'Already enrolled' if duplicate is not None else 'Course is full'
+
+
 @app.route('/api/enroll', methods=['POST'])
+@api_role_required('student')
+@idempotent
 def enroll_in_course():
     """Enroll a student in a course"""
-    if 'user_id' not in session or session.get('role') != 'student':
-        return jsonify({'error': 'Unauthorized'}), 401
 
     # Handle both JSON and form data
     data = request.get_json() if request.is_json else request.form
@@ -410,45 +3253,67 @@ def enroll_in_course():
     except (ValueError, TypeError):
         return jsonify({'error': 'Invalid course ID'}), 400
 
-    course = Course.query.get(course_id)
-    if not course:
-        return jsonify({'error': 'Course not found'}), 404
-
-    if course.is_full():
-        return jsonify({'error': 'Course is full'}), 400
-
-    #check if already enrolled
-    existing = Enrollment.query.filter_by(
-        student_id=session['user_id'],
-        course_id=course_id
-    ).first()
-
-    if existing:
-        return jsonify({'error': 'Already enrolled'}), 400
-
-    #check for time conflicts with student's existing courses
-    student_enrollments = Enrollment.query.filter_by(student_id=session['user_id']).all()
-    for enrollment in student_enrollments:
-        if has_time_conflict(course.time, enrollment.course.time):
-            return jsonify({'error': f'Time conflict with {enrollment.course.course_name}'}), 400
-
-    #create enrollment
-    enrollment = Enrollment(student_id=session['user_id'], course_id=course_id)
-    db.session.add(enrollment)
-    db.session.commit()
-
+    #the shared seat map answers without a query; open seats are confirmed by the insert below, and a
+    #"full" answer is re-read from the database first, since the map misses edits made outside the app
+    if seat_map.is_full(course_id):
+        seat_map.refresh([course_id])
+        if seat_map.is_full(course_id):
+            return jsonify({'error': 'Course is full'}), 400
+
+    #sharded mode: the router runs the same checks against the student's schedule on every shard
+    #and writes to the course's shard; the follow-up job still goes to the main database below
+    if shard_router is not None:
+        error = shard_router.enroll(session['user_id'], course_id)
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+    else:
+        #only the columns the checks need; the seat check happens in the conditional insert
+        course = db.session.execute(db.select(Course.time, Course.term).where(Course.id == course_id)).first()
+        if not course:
+            return jsonify({'error': 'Course not found'}), 404
+
+        #check if already enrolled
+        existing = db.session.scalar(db.select(Enrollment.id).where(
+            Enrollment.student_id == session['user_id'], Enrollment.course_id == course_id))
+
+        if existing:
+            return jsonify({'error': 'Already enrolled'}), 400
+
+        #check for time conflicts with student's existing courses in the same term
+        schedule = db.session.execute(
+            db.select(Enrollment.course_id, Course.course_name, Course.time)
+            .join(Course, Enrollment.course_id == Course.id)
+            .where(Enrollment.student_id == session['user_id'], Course.term == course.term)
+        ).all()
+        for enrolled_id, course_name, enrolled_time in schedule:
+            #a concurrent duplicate committed since the check above is not a conflict with itself
+            if enrolled_id == course_id:
+                return jsonify({'error': 'Already enrolled'}), 400
+            if has_time_conflict(course.time, enrolled_time):
+                return jsonify({'error': f'Time conflict with {course_name}'}), 400
+
+        #create enrollment, re-checking the seat and duplicate checks above at write time
+        if not db.session.execute(enrollment_insert(session['user_id'], course_id)).rowcount:
+            db.session.rollback()
+            return jsonify({'error': refused_enrollment_error(db.session, session['user_id'], course_id)}), 400
+
+    record_event('enrolled', student_id=session['user_id'], course_id=course_id)
+    enqueue_job(*refresh_course_job(course_id))
     # Redirect for form submissions, JSON for API calls
     if request.is_json:
-        return jsonify({'success': True, 'message': 'Enrolled successfully'}), 200
+        response = commit_response((jsonify({'success': True, 'message': 'Enrolled successfully'}), 200))
     else:
-        return redirect(url_for('student_dashboard'))
+        response = commit_response(redirect(url_for('student_dashboard')))
+    invalidate_course(course_id)
+    seat_map.adjust(course_id, 1)
+    return response
 
 
 @app.route('/api/unenroll', methods=['POST'])
+@api_role_required('student')
+@idempotent
 def unenroll_from_course():
     """Unenroll a student from a course"""
-    if 'user_id' not in session or session.get('role') != 'student':
-        return jsonify({'error': 'Unauthorized'}), 401
 
     # Handle both JSON and form data
     data = request.get_json() if request.is_json else request.form
@@ -460,54 +3325,455 @@ def unenroll_from_course():
     except (ValueError, TypeError):
         return jsonify({'error': 'Invalid course ID'}), 400
 
-    enrollment = Enrollment.query.filter_by(
-        student_id=session['user_id'],
-        course_id=course_id
-    ).first()
+    if shard_router is not None:
+        enrollment_id = shard_router.unenroll(session['user_id'], course_id)
+        if enrollment_id is None:
+            return jsonify({'error': 'Not enrolled in this course'}), 404
+    else:
+        enrollment = Enrollment.query.filter_by(
+            student_id=session['user_id'],
+            course_id=course_id
+        ).first()
 
-    if not enrollment:
-        return jsonify({'error': 'Not enrolled in this course'}), 404
+        if not enrollment:
+            return jsonify({'error': 'Not enrolled in this course'}), 404
 
-    db.session.delete(enrollment)
-    db.session.commit()
+        enrollment_id = enrollment.id
+        db.session.delete(enrollment)
 
+    ownership_cache.delete(('enrollment', enrollment_id))
+    record_event('unenrolled', enrollment_id=enrollment_id, student_id=session['user_id'], course_id=course_id)
+    enqueue_job(*refresh_course_job(course_id))
     # Redirect for form submissions, JSON for API calls
     if request.is_json:
-        return jsonify({'success': True, 'message': 'Unenrolled successfully'}), 200
+        response = commit_response((jsonify({'success': True, 'message': 'Unenrolled successfully'}), 200))
     else:
-        return redirect(url_for('student_dashboard'))
+        response = commit_response(redirect(url_for('student_dashboard')))
+    invalidate_course(course_id)
+    seat_map.adjust(course_id, -1)
+    return response
 
 
 @app.route('/api/update_grade', methods=['POST'])
+@api_role_required('teacher')
+@idempotent
 def update_grade():
     """Update a student's grade (teachers only)"""
-    if 'user_id' not in session or session.get('role') != 'teacher':
-        return jsonify({'error': 'Unauthorized'}), 401
-
     data = request.get_json()
     enrollment_id = data.get('enrollment_id')
     new_grade = data.get('grade')
 
-    enrollment = Enrollment.query.get(enrollment_id)
-    if not enrollment:
+    owner = enrollment_owner(enrollment_id)
+    if owner is None:
         return jsonify({'error': 'Enrollment not found'}), 404
 
     #verify teacher owns this course
-    if enrollment.course.teacher_id != session['user_id']:
+    course_id, teacher_id = owner
+    if teacher_id != session['user_id']:
         return jsonify({'error': 'Unauthorized'}), 403
 
     try:
-        enrollment.grade = float(new_grade)
-        db.session.commit()
-        return jsonify({'success': True, 'message': 'Grade updated'}), 200
-    except ValueError:
+        grade = float(new_grade)
+    except (ValueError, TypeError):
         return jsonify({'error': 'Invalid grade value'}), 400
 
+    #single UPDATE by primary key; no need to load the Enrollment row
+    if shard_router is not None:
+        updated = shard_router.update_grade(course_id, enrollment_id, grade)
+    else:
+        updated = db.session.execute(
+            db.update(Enrollment).where(Enrollment.id == enrollment_id).values(grade=grade)).rowcount
+    if not updated:
+        #unenrolled since the cached ownership lookup
+        db.session.rollback()
+        ownership_cache.delete(('enrollment', enrollment_id))
+        return jsonify({'error': 'Enrollment not found'}), 404
+    record_event('grade_changed', enrollment_id=enrollment_id, course_id=course_id, grade=grade)
+    enqueue_job(*refresh_course_job(course_id))
+    response = commit_response((jsonify({'success': True, 'message': 'Grade updated'}), 200))
+    invalidate_course(course_id)
+    return response
+
+
+@app.route('/admin/cache/stats')
+@api_role_required('admin')
+def cache_stats():
+    """Cache hit/miss/eviction counters (admins only)"""
+    stats = cache.stats()
+    stats['fragments'] = fragment_cache.stats()
+    return jsonify(stats), 200
+
+
+@app.route('/admin/jobs/stats')
+@api_role_required('admin')
+def job_stats():
+    """Background job queue depth, latency and failure counts (admins only)"""
+    return jsonify(job_worker.stats()), 200
+
+
+#==================== Schedule Builder ====================
+
+MINUTES_PER_DAY = 24 * 60
+SCHEDULE_MAX_RESULTS = 20
+SCHEDULE_MAX_COURSES = 10
+
+
+def meeting_mask(time_str):
+    """
+    Encode a course time as a bitmask with one bit per minute of the week (Mon-Fri)
+    Two courses conflict exactly when their masks share a bit; unparseable times give 0,
+    matching has_time_conflict's "assume no conflict"
+    """
+    mask = 0
+    for days, start, end in parse_meetings(time_str) or []:
+        if end <= start:
+            continue
+        block = (1 << (end - start)) - 1
+        for day in days:
+            mask |= block << (WEEKDAYS.index(day) * MINUTES_PER_DAY + start)
+    return mask
+
+
+class Section:
+    """One candidate course row for the schedule search"""
+    __slots__ = ('id', 'course_name', 'teacher', 'time', 'enrolled', 'capacity', 'mask', 'days', 'start', 'cost')
+
+    def __init__(self, course_id, course_name, teacher, course_time, enrolled, capacity):
+        self.id = course_id
+        self.course_name = course_name
+        self.teacher = teacher
+        self.time = course_time
+        self.enrolled = enrolled
+        self.capacity = capacity
+        self.mask = meeting_mask(course_time)
+        slots = parse_meetings(course_time) or []
+        self.days = set().union(*(days for days, _, _ in slots))
+        self.start = min((start for _, start, _ in slots), default=None)
+        self.cost = 0
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'course_name': self.course_name,
+            'teacher': self.teacher,
+            'time': self.time,
+            'enrolled': self.enrolled,
+            'capacity': self.capacity
+        }
+
+
+def section_cost(section, prefer):
+    """Additive start-time cost: 'earliest' favours early starts, 'latest' favours late ones"""
+    if section.start is None or prefer not in ('earliest', 'latest'):
+        return 0
+    return section.start if prefer == 'earliest' else MINUTES_PER_DAY - section.start
+
+
+def build_schedules(groups, base_mask=0, limit=5, prefer=None, free_days=()):
+    """
+    Find the best conflict-free schedules taking one section from each group
+
+    groups: list of section lists, one list per wanted course
+    Schedules are ranked by (number of wanted free days that have classes, total start-time cost).
+    Backtracking over bitmasks with three prunes: a section that overlaps the schedule so far,
+    a partial schedule that leaves some remaining course with no compatible section, and a
+    partial schedule whose best possible score cannot beat the current top `limit`.
+    Returns a list of (score, [Section, ...]) best first.
+    """
+    free_days = set(free_days)
+    for group in groups:
+        for section in group:
+            section.cost = section_cost(section, prefer)
+        group.sort(key=lambda sec: (len(sec.days & free_days), sec.cost))
+
+    #fewest sections first so dead ends are found near the root
+    groups = sorted(groups, key=len)
+    #cheapest possible cost still to come after position i (admissible bound)
+    remaining_cost = [0] * (len(groups) + 1)
+    for i in range(len(groups) - 1, -1, -1):
+        remaining_cost[i] = remaining_cost[i + 1] + min(sec.cost for sec in groups[i])
+
+    best = []  #max-heap via negated scores: (-violations, -cost, counter, sections)
+    counter = 0
+    chosen = []
+
+    def worst_kept():
+        return (-best[0][0], -best[0][1])
+
+    def search(i, mask, busy_free_days, cost):
+        nonlocal counter
+        if len(best) >= limit and (len(busy_free_days), cost + remaining_cost[i]) >= worst_kept():
+            return
+        if i == len(groups):
+            counter += 1
+            entry = (-len(busy_free_days), -cost, counter, list(chosen))
+            if len(best) < limit:
+                heapq.heappush(best, entry)
+            else:
+                heapq.heapreplace(best, entry)
+            return
+
+        for section in groups[i]:
+            if section.mask & mask:
+                continue
+            new_mask = mask | section.mask
+            #forward check: every later course must still have a section that fits
+            if any(all(sec.mask & new_mask for sec in group) for group in groups[i + 1:]):
+                continue
+            chosen.append(section)
+            search(i + 1, new_mask, busy_free_days | (section.days & free_days), cost + section.cost)
+            chosen.pop()
+
+    search(0, base_mask, frozenset(), 0)
+
+    ranked = sorted(best, key=lambda entry: (-entry[0], -entry[1], entry[2]))
+    return [((-violations, -cost), sections) for violations, cost, _, sections in ranked]
+
+
+@app.route('/api/schedule', methods=['POST'])
+@api_role_required('student')
+def build_schedule():
+    """
+    Suggest conflict-free schedules for a wish list of course names
+    JSON body: {"courses": [...], "prefer": "earliest"|"latest", "free_days": ["F"], "limit": 5}
+    """
+    data = request.get_json(silent=True) or {}
+    names = data.get('courses') or []
+    prefer = data.get('prefer')
+    free_days = data.get('free_days') or []
+
+    if not isinstance(names, list) or not names or not all(isinstance(n, str) for n in names):
+        return jsonify({'error': 'courses must be a non-empty list of course names'}), 400
+    names = list(dict.fromkeys(names))
+    if len(names) > SCHEDULE_MAX_COURSES:
+        return jsonify({'error': f'At most {SCHEDULE_MAX_COURSES} courses per request'}), 400
+    if prefer not in (None, 'earliest', 'latest'):
+        return jsonify({'error': "prefer must be 'earliest' or 'latest'"}), 400
+    if not isinstance(free_days, list) or any(day not in WEEKDAYS for day in free_days):
+        return jsonify({'error': f'free_days must use day letters from {WEEKDAYS}'}), 400
+    try:
+        limit = max(1, min(int(data.get('limit', 5)), SCHEDULE_MAX_RESULTS))
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    user_id = session['user_id']
+
+    #student's current-term schedule is fixed; its courses can't be requested again
+    term = app.config['CURRENT_TERM']
+    if shard_router is not None:
+        current = [(name, course_time) for _, _, name, course_time in shard_router.student_schedule(user_id, term)]
+    else:
+        current = db.session.execute(
+            db.select(Course.course_name, Course.time)
+            .join(Enrollment, Enrollment.course_id == Course.id)
+            .where(Enrollment.student_id == user_id, Course.term == term)
+        ).all()
+    already = sorted({name for name, _ in current} & set(names))
+    if already:
+        return jsonify({'error': f"Already enrolled in {', '.join(already)}"}), 400
+    base_mask = 0
+    for _, course_time in current:
+        base_mask |= meeting_mask(course_time)
+
+    #every section of every wanted course, with seat counts, in one query (one per shard when sharded)
+    if shard_router is not None:
+        rows = [(c.id, c.course_name, c.teacher, c.time, c.enrolled, c.capacity)
+                for c in shard_router.load_catalog(course_names=names)]
+    else:
+        rows = db.session.execute(
+            db.select(Course.id, Course.course_name, User.full_name, Course.time,
+                      db.func.count(Enrollment.id), Course.capacity)
+            .join(User, Course.teacher_id == User.id)
+            .outerjoin(Enrollment, Enrollment.course_id == Course.id)
+            .where(Course.course_name.in_(names), Course.term == term)
+            .group_by(Course.id)
+        ).all()
+
+    sections = {name: [] for name in names}
+    for course_id, course_name, teacher, course_time, enrolled, capacity in rows:
+        if enrolled < capacity:
+            sections[course_name].append(Section(course_id, course_name, teacher, course_time, enrolled, capacity))
+
+    unavailable = [name for name, group in sections.items() if not group]
+    if unavailable:
+        return jsonify({'error': f"No open sections for {', '.join(unavailable)}"}), 400
+
+    schedules = build_schedules(list(sections.values()), base_mask, limit, prefer, free_days)
+    return jsonify({
+        'success': True,
+        'schedules': [{
+            'free_day_conflicts': score[0],
+            'sections': [sec.to_dict() for sec in sorted(chosen, key=lambda sec: names.index(sec.course_name))]
+        } for score, chosen in schedules]
+    }), 200
+
+
+@app.route('/api/transcript')
+@api_role_required('student')
+def transcript():
+    """The signed-in student's courses and grades, grouped by term, including archived terms"""
+    terms = []
+    for entry in load_transcript(session['user_id']):
+        if not terms or terms[-1]['term'] != entry.term:
+            terms.append({'term': entry.term, 'archived': entry.archived, 'courses': []})
+        terms[-1]['courses'].append({'course_name': entry.course_name, 'teacher': entry.teacher, 'grade': entry.grade})
+    return jsonify({'terms': terms}), 200
+
+
+@app.route('/admin/terms')
+@api_role_required('admin')
+def term_stats():
+    """Per-term course, enrollment and grade totals across active and archived data (admins only)"""
+    return jsonify({'current_term': app.config['CURRENT_TERM'], 'terms': term_summary()}), 200
+
+
+@app.route('/admin/audit')
+@api_role_required('admin')
+def catalog_audit():
+    """Instructor clash, unparseable time and capacity audit of the whole catalog (admins only)"""
+    return jsonify(audit_catalog()), 200
+
+
+@app.route('/admin/seats/check', methods=['GET', 'POST'])
+@api_role_required('admin')
+def seat_map_check():
+    """Compare the shared seat map with the enrollments table; POST also repairs it (admins only)"""
+    return jsonify(check_seat_map(repair=request.method == 'POST')), 200
+
+
+#==================== Export Routes ====================
+
+EXPORT_BATCH_SIZE = 1000  #rows fetched per cursor round trip and written per chunk
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+ROSTER_HEADER = ('Student Name', 'Username', 'Grade')
+GRADEBOOK_HEADER = ('Course', 'Instructor', 'Time', 'Student Name', 'Username', 'Grade')
+
+
+def roster_query(course_id):
+    """Column-only query for one course's roster, ordered by student name"""
+    return (db.select(User.full_name, User.username, Enrollment.grade)
+            .join(Enrollment, Enrollment.student_id == User.id)
+            .where(Enrollment.course_id == course_id)
+            .order_by(User.full_name, Enrollment.id))
+
+
+def gradebook_query():
+    """Column-only query for every enrollment in the term"""
+    instructor = db.aliased(User)
+    student = db.aliased(User)
+    return (db.select(Course.course_name, instructor.full_name, Course.time,
+                      student.full_name, student.username, Enrollment.grade)
+            .join(instructor, Course.teacher_id == instructor.id)
+            .join(Enrollment, Enrollment.course_id == Course.id)
+            .join(student, Enrollment.student_id == student.id)
+            .order_by(Course.course_name, Course.id, student.full_name, Enrollment.id))
+
+
+def stream_rows(stmt, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yield rows from a server-side cursor, fetching batch_size rows at a time
+    Uses its own connection so the request session is never holding the whole result
+    """
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(stmt)
+        for row in result:
+            yield tuple(row)
+
+
+def generate_csv(header, rows, batch_size=EXPORT_BATCH_SIZE):
+    """Write rows as CSV, yielding one encoded chunk per batch_size rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % batch_size == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def generate_xlsx(header, rows, title, chunk_size=64 * 1024):
+    """
+    Write rows with openpyxl's write-only mode and stream the finished file
+    Write-only worksheets spool rows to disk, so memory does not grow with the row count
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title[:31])
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def export_response(header, rows, filename, fmt):
+    """Build a streamed CSV or XLSX download for an iterable of rows"""
+    if fmt == 'csv':
+        body = generate_csv(header, rows)
+        mimetype = 'text/csv'
+    else:
+        body = generate_xlsx(header, rows, title=filename)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'
+    })
+
+
+@app.route('/teacher/course/<int:course_id>/export.<fmt>')
+@role_required('teacher')
+@course_owner_required
+def export_course_roster(course_id, fmt):
+    """Download the roster and grades for one of the teacher's courses"""
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+
+    filename = f'roster-course-{course_id}'
+    rows = shard_router.roster_rows(course_id) if shard_router is not None else stream_rows(roster_query(course_id))
+    return export_response(ROSTER_HEADER, rows, filename, fmt)
+
+
+@app.route('/admin/export/gradebook.<fmt>')
+@role_required('admin')
+def export_gradebook(fmt):
+    """Download every enrollment and grade in the term (admins only)"""
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    if shard_router is not None:
+        abort(409, description='The gradebook export is not available in sharded mode')
+
+    return export_response(GRADEBOOK_HEADER, stream_rows(gradebook_query()), 'gradebook', fmt)
+
 
 if __name__ == '__main__':
     #create database tables
     with app.app_context():
         db.create_all()
+        upgrade_schema()
         print("Database tables created!")
 
+        #databases created before meeting times were normalized need a one-time backfill
+        if db.session.scalar(db.select(db.func.count(CourseMeeting.id))) == 0:
+            backfill_course_meetings()
+
+        #rebuild the shared seat map from the enrollments table on every start
+        seat_map.clear()
+        seat_map.load()
+
+    #with the debug reloader, only the child process that serves requests runs jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_worker.start()
+
     app.run(debug=True, port=5001) #PORT LOCATION
@@ -0,0 +1,432 @@
+"""
+Async serving mode for the ACME University Enrollment System
+
+JSON requests to /login, /api/enroll, /api/unenroll and /api/update_grade are handled
+by async handlers on an aiosqlite engine, with password hashing offloaded to a bounded
+thread pool. Every other request (pages, form posts, Flask-Admin) is passed to the Flask
+app unchanged, so both modes share routes, sessions and in-process caches.
+
+Run with:
+    uvicorn asgi:application --workers 1
+"""
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.http import dump_cookie, parse_cookie
+from werkzeug.security import check_password_hash
+
+from app import (app, db, User, Course, Enrollment, has_time_conflict, invalidate_course,
+                 ownership_cache, job_statement, job_worker, refresh_course_job, _MISSING,
+                 IDEMPOTENCY_HEADER, request_fingerprint, idempotency_lookup, idempotency_claim_statements,
+                 idempotency_store_statement, idempotency_release_statement, idempotent_replay, shard_router,
+                 seat_map, enrollment_insert, refused_enrollment_error, UserSession, session_cache,
+                 session_lookup, session_record, session_contents, session_insert, stored_session_data,
+                 new_session_id, new_event, event_statements, publish_event)
+
+app.config.setdefault('ASYNC_PASSWORD_WORKERS', 4)  #concurrent password checks per worker
+app.config.setdefault('ASYNC_DB_POOL_SIZE', 10)
+
+
+def async_database_url(url):
+    """Swap the sync SQLite driver for aiosqlite"""
+    if url.startswith('sqlite:'):
+        return 'sqlite+aiosqlite:' + url[len('sqlite:'):]
+    return url
+
+
+def create_engine():
+    """Async engine on the app's database; in-memory SQLite keeps its single static connection"""
+    url = async_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url in ('sqlite+aiosqlite://', 'sqlite+aiosqlite:///:memory:'):
+        return create_async_engine(url)
+    return create_async_engine(url, pool_size=app.config['ASYNC_DB_POOL_SIZE'])
+
+
+engine = create_engine()
+password_executor = ThreadPoolExecutor(max_workers=app.config['ASYNC_PASSWORD_WORKERS'],
+                                       thread_name_prefix='password-hash')
+flask_application = WsgiToAsgi(app)
+
+with app.test_request_context():
+    from flask import url_for
+    DASHBOARDS = {
+        'student': url_for('student_dashboard'),
+        'teacher': url_for('teacher_dashboard'),
+        'admin': '/admin'
+    }
+
+
+#==================== Sessions ====================
+#the same server-side sessions as the Flask app (sessions table behind session_cache),
+#so logins carry over between both modes
+
+async def load_session(cookies):
+    """Session dict for the session id cookie, {} when missing, expired or revoked"""
+    sid = cookies.get(app.config['SESSION_COOKIE_NAME'])
+    if not sid:
+        return {}
+    record = session_cache.get(sid, _MISSING)
+    if record is _MISSING:
+        async with engine.connect() as conn:
+            record = session_record((await conn.execute(session_lookup(sid))).first())
+        session_cache.set(sid, record)
+    return session_contents(record)
+
+
+async def start_session(old_sid, context):
+    """
+    Store a new session for a user who just signed in (replacing old_sid, if any)
+    and return the Set-Cookie header value carrying its id
+    """
+    sid = new_session_id()
+    expires_at = time.time() + app.permanent_session_lifetime.total_seconds()
+    data = stored_session_data(context)
+    async with engine.begin() as conn:
+        if old_sid:
+            await conn.execute(db.delete(UserSession).where(UserSession.id == old_sid))
+        await conn.execute(session_insert(sid, context['user_id'], data, expires_at))
+    if old_sid:
+        session_cache.delete(old_sid)
+    session_cache.set(sid, (expires_at, context, data))
+    return dump_cookie(app.config['SESSION_COOKIE_NAME'], sid,
+                       path=app.config['SESSION_COOKIE_PATH'] or '/',
+                       domain=app.config['SESSION_COOKIE_DOMAIN'] or None,
+                       httponly=app.config['SESSION_COOKIE_HTTPONLY'],
+                       secure=app.config['SESSION_COOKIE_SECURE'],
+                       samesite=app.config['SESSION_COOKIE_SAMESITE'])
+
+
+#==================== Request Plumbing ====================
+
+class AsyncRequest:
+    """The parts of an HTTP request the async handlers need"""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.body = body
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope['headers']}
+        self.cookies = parse_cookie(self.headers.get('cookie', ''))
+        self.session = {}  #filled by load_session before the handler runs
+        self.idempotency_claim = None  #(user id, key) of a claimed Idempotency-Key (see store_response)
+        self.idempotency_stored = False  #the response was stored with the handler's write
+        self.json = json.loads(body) if body else None
+
+
+def wants_json(scope):
+    """True for requests the async handlers own (JSON bodies); the rest go to Flask"""
+    for name, value in scope['headers']:
+        if name.lower() == b'content-type':
+            return value.split(b';')[0].strip().lower() == b'application/json'
+    return False
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_response(send, status, headers, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-length', str(len(body)).encode())]
+                   + [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status, payload, headers=()):
+    await send_response(send, status, [('Content-Type', 'application/json'), *headers],
+                        json.dumps(payload).encode('utf-8'))
+
+
+def require_role(request, role):
+    """Return the user id when the session has this role, otherwise None"""
+    if request.session.get('role') != role or 'user_id' not in request.session:
+        return None
+    return request.session['user_id']
+
+
+def parse_course_id(data):
+    """Mirror the sync routes: int course ids, None when absent, ValueError when invalid"""
+    course_id = (data or {}).get('course_id')
+    return int(course_id) if course_id else None
+
+
+#==================== Async Handlers ====================
+#each returns (status, payload, extra headers) and mirrors the checks of the Flask view it replaces
+
+async def login(request):
+    data = request.json or {}
+    async with engine.connect() as conn:
+        user = (await conn.execute(
+            db.select(User.id, User.username, User.full_name, User.role, User.password_hash)
+            .where(User.username == data.get('username'))
+        )).first()
+
+    if user is not None and data.get('password') is not None:
+        loop = asyncio.get_running_loop()
+        valid = await loop.run_in_executor(password_executor, check_password_hash,
+                                           user.password_hash, data.get('password'))
+        if valid:
+            cookie = await start_session(request.cookies.get(app.config['SESSION_COOKIE_NAME']),
+                                         {'user_id': user.id, 'username': user.username,
+                                          'full_name': user.full_name, 'role': user.role})
+            return 200, {'success': True, 'role': user.role,
+                         'redirect': DASHBOARDS.get(user.role, '/admin')}, [('Set-Cookie', cookie)]
+
+    return 401, {'success': False, 'error': 'Invalid credentials'}, []
+
+
+async def enroll(request):
+    user_id = require_role(request, 'student')
+    if user_id is None:
+        return 401, {'error': 'Unauthorized'}, []
+    try:
+        course_id = parse_course_id(request.json)
+    except (ValueError, TypeError):
+        return 400, {'error': 'Invalid course ID'}, []
+    async with engine.begin() as conn:
+        course = (await conn.execute(
+            db.select(Course.time, Course.capacity, Course.term).where(Course.id == course_id)
+        )).first()
+        if course is None:
+            return 404, {'error': 'Course not found'}, []
+
+        #read here rather than trusted from the seat map, which can lag edits made outside the app
+        enrolled = await conn.scalar(db.select(db.func.count(Enrollment.id))
+                                     .where(Enrollment.course_id == course_id))
+        if enrolled >= course.capacity:
+            seat_map.set(course_id, (course.capacity, enrolled))
+            return 400, {'error': 'Course is full'}, []
+
+        existing = await conn.scalar(db.select(Enrollment.id).where(
+            Enrollment.student_id == user_id, Enrollment.course_id == course_id))
+        if existing is not None:
+            return 400, {'error': 'Already enrolled'}, []
+
+        schedule = await conn.execute(
+            db.select(Course.course_name, Course.time)
+            .join(Enrollment, Enrollment.course_id == Course.id)
+            .where(Enrollment.student_id == user_id, Course.term == course.term)
+        )
+        for other_name, other_time in schedule:
+            if has_time_conflict(course.time, other_time):
+                return 400, {'error': f'Time conflict with {other_name}'}, []
+
+        if not (await conn.execute(enrollment_insert(user_id, course_id))).rowcount:
+            error = await conn.run_sync(lambda sync_conn: refused_enrollment_error(sync_conn, user_id, course_id))
+            return 400, {'error': error}, []
+        event = new_event('enrolled', user_id, student_id=user_id, course_id=course_id)
+        for stmt in [job_statement(*refresh_course_job(course_id)), *event_statements(event)]:
+            await conn.execute(stmt)
+        response = await store_response(conn, request, 200, {'success': True, 'message': 'Enrolled successfully'})
+
+    publish_event(event)
+    invalidate_course(course_id)
+    seat_map.adjust(course_id, 1)
+    job_worker.wake()
+    return response
+
+
+async def unenroll(request):
+    user_id = require_role(request, 'student')
+    if user_id is None:
+        return 401, {'error': 'Unauthorized'}, []
+    try:
+        course_id = parse_course_id(request.json)
+    except (ValueError, TypeError):
+        return 400, {'error': 'Invalid course ID'}, []
+
+    async with engine.begin() as conn:
+        enrollment_id = await conn.scalar(db.select(Enrollment.id).where(
+            Enrollment.student_id == user_id, Enrollment.course_id == course_id))
+        if enrollment_id is None:
+            return 404, {'error': 'Not enrolled in this course'}, []
+        await conn.execute(db.delete(Enrollment).where(Enrollment.id == enrollment_id))
+        event = new_event('unenrolled', user_id, enrollment_id=enrollment_id, student_id=user_id, course_id=course_id)
+        for stmt in [job_statement(*refresh_course_job(course_id)), *event_statements(event)]:
+            await conn.execute(stmt)
+        response = await store_response(conn, request, 200, {'success': True, 'message': 'Unenrolled successfully'})
+
+    publish_event(event)
+
+    ownership_cache.delete(('enrollment', enrollment_id))
+    invalidate_course(course_id)
+    seat_map.adjust(course_id, -1)
+    job_worker.wake()
+    return response
+
+
+async def enrollment_owner(conn, enrollment_id):
+    """Async twin of app.enrollment_owner, sharing its cache"""
+    key = ('enrollment', enrollment_id)
+    owner = ownership_cache.get(key, _MISSING)
+    if owner is _MISSING:
+        row = (await conn.execute(
+            db.select(Enrollment.course_id, Course.teacher_id)
+            .join(Course, Enrollment.course_id == Course.id)
+            .where(Enrollment.id == enrollment_id)
+        )).first()
+        owner = tuple(row) if row else None
+        ownership_cache.set(key, owner)
+    return owner
+
+
+async def update_grade(request):
+    teacher = require_role(request, 'teacher')
+    if teacher is None:
+        return 401, {'error': 'Unauthorized'}, []
+    data = request.json or {}
+    enrollment_id = data.get('enrollment_id')
+
+    async with engine.begin() as conn:
+        owner = await enrollment_owner(conn, enrollment_id)
+        if owner is None:
+            return 404, {'error': 'Enrollment not found'}, []
+        course_id, teacher_id = owner
+        if teacher_id != teacher:
+            return 403, {'error': 'Unauthorized'}, []
+        try:
+            grade = float(data.get('grade'))
+        except (ValueError, TypeError):
+            return 400, {'error': 'Invalid grade value'}, []
+        updated = await conn.execute(db.update(Enrollment).where(Enrollment.id == enrollment_id).values(grade=grade))
+        if not updated.rowcount:
+            ownership_cache.delete(('enrollment', enrollment_id))  #unenrolled since the cached lookup
+            return 404, {'error': 'Enrollment not found'}, []
+        event = new_event('grade_changed', teacher, enrollment_id=enrollment_id, course_id=course_id, grade=grade)
+        for stmt in [job_statement(*refresh_course_job(course_id)), *event_statements(event)]:
+            await conn.execute(stmt)
+        response = await store_response(conn, request, 200, {'success': True, 'message': 'Grade updated'})
+
+    publish_event(event)
+
+    invalidate_course(course_id)
+    job_worker.wake()
+    return response
+
+
+def encode_response(status, payload, headers):
+    """(status, headers, body) of a handler's JSON answer"""
+    return status, [('Content-Type', 'application/json'), *headers], json.dumps(payload).encode('utf-8')
+
+
+async def store_response(conn, request, status, payload, headers=()):
+    """
+    Async twin of app.commit_response: inside a write's transaction, store the response for the
+    request's Idempotency-Key (if it claimed one) so both commit together; returns the handler result
+    """
+    if request.idempotency_claim is not None:
+        _, encoded_headers, body = encode_response(status, payload, list(headers))
+        await conn.execute(idempotency_store_statement(*request.idempotency_claim, status, dict(encoded_headers), body))
+        request.idempotency_stored = True
+    return status, payload, list(headers)
+
+
+async def idempotent(handler, request):
+    """
+    Async twin of app.idempotent, sharing its table: returns (status, headers, body),
+    replaying a stored response when the Idempotency-Key was already used
+    """
+    encode = encode_response
+    key = request.headers.get(IDEMPOTENCY_HEADER.lower())
+    if not key or request.path == '/login':
+        return encode(*await handler(request))
+    if len(key) > 200:
+        return encode(400, {'error': f'{IDEMPOTENCY_HEADER} must be at most 200 characters'}, [])
+    user_id = request.session.get('user_id')
+    if user_id is None:
+        return encode(*await handler(request))  #the handler answers 401
+
+    fingerprint = request_fingerprint(request.method, request.path, request.body)
+    async with engine.begin() as conn:
+        record = (await conn.execute(idempotency_lookup(user_id, key))).first()
+        if record is None:
+            claimed = [await conn.execute(stmt) for stmt in idempotency_claim_statements(user_id, key, fingerprint)]
+            if not claimed[1].rowcount:
+                record = (await conn.execute(idempotency_lookup(user_id, key))).first()
+    if record is not None:
+        status, headers, body = idempotent_replay(record, fingerprint)
+        return status, list(headers.items()), body
+
+    request.idempotency_claim = (user_id, key)
+    try:
+        status, headers, body = encode(*await handler(request))
+    except Exception:
+        if not request.idempotency_stored:
+            async with engine.begin() as conn:
+                await conn.execute(idempotency_release_statement(user_id, key))
+        raise
+    if request.idempotency_stored:
+        return status, headers, body
+    async with engine.begin() as conn:
+        if status >= 500:
+            await conn.execute(idempotency_release_statement(user_id, key))
+        else:
+            await conn.execute(idempotency_store_statement(user_id, key, status, dict(headers), body))
+    return status, headers, body
+
+
+ASYNC_ROUTES = {
+    '/login': login,
+    '/api/enroll': enroll,
+    '/api/unenroll': unenroll,
+    '/api/update_grade': update_grade,
+}
+if shard_router is not None:
+    #the async handlers only know the main database; sharded writes go through Flask's router
+    ASYNC_ROUTES = {'/login': login}
+
+
+#==================== ASGI Application ====================
+
+def load_seat_map():
+    """Rebuild the shared seat map from the database, as `python app.py` does on start"""
+    with app.app_context():
+        seat_map.clear()
+        seat_map.load()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            job_worker.start()
+            await asyncio.to_thread(load_seat_map)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.to_thread(job_worker.stop)
+            await engine.dispose()
+            password_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    handler = ASYNC_ROUTES.get(scope.get('path')) if scope.get('method') == 'POST' else None
+    if scope['type'] != 'http' or handler is None or not wants_json(scope):
+        return await flask_application(scope, receive, send)
+
+    body = await read_body(receive)
+    try:
+        request = AsyncRequest(scope, body)
+    except ValueError:
+        return await send_json(send, 400, {'error': 'Invalid JSON'})
+    request.session = await load_session(request.cookies)
+    await send_response(send, *await idempotent(handler, request))
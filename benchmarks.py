@@ -0,0 +1,711 @@
+"""
+Benchmarks for the ACME University Enrollment System
+
+Each benchmark builds its own throwaway SQLite database, so the real enrollment.db is never touched.
+Run one with:  python benchmarks.py <name>
+List them with: python benchmarks.py --list
+"""
+
+import os
+import sys
+import tempfile
+import time
+import zlib
+
+_workdir = tempfile.mkdtemp(prefix='acme-bench-')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(_workdir, 'bench.db'))
+
+from werkzeug.security import generate_password_hash
+
+from app import app, db, cache, fragment_cache, User, Course, Enrollment, ArchivedEnrollment
+from app import archive_term, audit_catalog, backfill_course_meetings, has_time_conflict, load_course_catalog, load_roster
+from app import EventLog, ServerSessionInterface, session_cache
+from app import ShardRouter, backup_database, check_seat_map, database_path, parse_rollover_csv, rollover_term, seat_map
+
+BENCHMARKS = {}
+
+DAY_PATTERNS = ('MWF', 'TR', 'MW', 'F', 'T', 'R', 'M')
+
+
+def benchmark(func):
+    """Register a benchmark under its function name"""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def course_time(i):
+    """Deterministic spread of meeting times like 'MWF 10:00-10:50 AM'"""
+    days = DAY_PATTERNS[i % len(DAY_PATTERNS)]
+    hour = 8 + (i // len(DAY_PATTERNS)) % 10  #8 AM .. 5 PM
+    suffix = 'AM' if hour < 12 else 'PM'
+    display = hour if hour <= 12 else hour - 12
+    return f'{days} {display}:00-{display}:50 {suffix}'
+
+
+def seed(courses=100, teachers=10, students=100, enrollments_per_course=5):
+    """
+    Recreate the schema and bulk-insert sample data
+    Every user shares one precomputed password hash ('password123') so seeding stays fast
+    """
+    password_hash = generate_password_hash('password123')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        users = [{'username': f'teacher{i}', 'full_name': f'Teacher {i}', 'role': 'teacher',
+                  'password_hash': password_hash} for i in range(teachers)]
+        users += [{'username': f'student{i}', 'full_name': f'Student {i}', 'role': 'student',
+                   'password_hash': password_hash} for i in range(students)]
+        users.append({'username': 'admin', 'full_name': 'System Administrator', 'role': 'admin',
+                      'password_hash': password_hash})
+        db.session.execute(db.insert(User), users)
+
+        # ids are assigned in insert order: teachers 1..T, students T+1..T+S
+        if courses:
+            db.session.execute(db.insert(Course), [{
+                'course_name': f'Course {i}',
+                'teacher_id': 1 + i % teachers,
+                'time': course_time(i),
+                'capacity': enrollments_per_course * 2,
+            } for i in range(courses)])
+
+        if courses and students and enrollments_per_course:
+            db.session.execute(db.insert(Enrollment), [{
+                'student_id': teachers + 1 + (c * enrollments_per_course + k) % students,
+                'course_id': c + 1,
+                'grade': float((c + k) % 100),
+            } for c in range(courses) for k in range(enrollments_per_course)])
+        db.session.commit()
+
+    cache.clear()
+    fragment_cache.clear()
+
+
+def login(client, username, password='password123'):
+    """Log a test client in"""
+    client.post('/login', data={'username': username, 'password': password})
+    return client
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def timed_get(client, path, headers=None):
+    """
+    Return (time to first decodable content, total time, bytes on the wire) for a GET request
+    A gzip body counts from the first chunk that decompresses to page content, not its gzip header
+    """
+    start = time.perf_counter()
+    response = client.get(path, headers=headers or {}, buffered=False)
+    decoder = zlib.decompressobj(31) if response.headers.get('Content-Encoding') == 'gzip' else None
+    ttfb, size = None, 0
+    for chunk in response.response:
+        size += len(chunk)
+        if ttfb is None and (decoder.decompress(chunk) if decoder else chunk):
+            ttfb = time.perf_counter() - start
+    response.close()
+    total = time.perf_counter() - start
+    return ttfb if ttfb is not None else total, total, size
+
+
+@benchmark
+def dashboard_streaming(runs=5):
+    """Student dashboard time to first decoded content and bytes on the wire for a 10k-course catalog"""
+    seed(courses=10000, teachers=200, students=500, enrollments_per_course=2)
+    client = login(app.test_client(), 'student0')
+
+    scenarios = [
+        ('before (buffered, uncompressed, no fragments)',
+         dict(STREAM_TEMPLATES=False, COMPRESS_RESPONSES=False), False),
+        ('after (streamed, gzip, fragment cache)',
+         dict(STREAM_TEMPLATES=True, COMPRESS_RESPONSES=True), True),
+    ]
+    print(f"{'scenario':<48} {'first ms':>9} {'total ms':>9} {'bytes':>10}")
+    for label, config, use_fragments in scenarios:
+        app.config.update(config)
+        if not use_fragments:
+            original_set = fragment_cache.set
+            fragment_cache.set = lambda *args, **kwargs: None
+        timed_get(client, '/student/dashboard', {'Accept-Encoding': 'gzip'})  #warm the catalog cache
+        results = [timed_get(client, '/student/dashboard', {'Accept-Encoding': 'gzip'}) for _ in range(runs)]
+        if not use_fragments:
+            fragment_cache.set = original_set
+        ttfb = sum(r[0] for r in results) / runs * 1000
+        total = sum(r[1] for r in results) / runs * 1000
+        print(f'{label:<48} {ttfb:>9.1f} {total:>9.1f} {results[-1][2]:>10}')
+
+
+@benchmark
+def admin_list(runs=5):
+    """Flask-Admin Enrollment/Course list pages with 1M enrollments and 10k instructors"""
+    from flask_admin.contrib.sqla import ModelView
+    from app import admin
+
+    start = time.perf_counter()
+    seed(courses=20000, teachers=10000, students=20000, enrollments_per_course=50)
+    print(f'seeded 1,000,000 enrollments in {time.perf_counter() - start:.1f}s')
+
+    views = {view.model.__name__: view for view in admin._views if hasattr(view, 'model')}
+    print(f"{'view':<12} {'page':>6} {'default ms':>11} {'scaled ms':>10}")
+    with app.test_request_context('/admin/'):
+        for name, pages in (('Enrollment', (0, 100, 49999)), ('Course', (0, 999))):
+            view = views[name]
+            for page in pages:
+                cache.clear()
+                def default():
+                    count, rows = ModelView.get_list(view, page, None, False, None, None)
+                    for row in rows:
+                        [str(getattr(row, c)) for c, _ in view._list_columns]
+                def scaled():
+                    count, rows = view.get_list(page, None, False, None, None)
+                    for row in rows:
+                        [str(getattr(row, c)) for c, _ in view._list_columns]
+                timings = []
+                for func in (default, scaled):
+                    func()  #warm up; the scaled view's count is then cached as it is between page views
+                    begin = time.perf_counter()
+                    for _ in range(runs):
+                        func()
+                    timings.append((time.perf_counter() - begin) / runs * 1000)
+                print(f'{name:<12} {page:>6} {timings[0]:>11.1f} {timings[1]:>10.1f}')
+
+
+@benchmark
+def schedule_builder(runs=50):
+    """/api/schedule latency for 6 wanted courses with 10 sections each"""
+    seed(courses=0, teachers=10, students=1, enrollments_per_course=0)
+    with app.app_context():
+        db.session.execute(db.insert(Course), [{
+            'course_name': f'Course {c}',
+            'teacher_id': 1 + s,
+            'time': course_time(c * 10 + s),
+            'capacity': 30,
+        } for c in range(6) for s in range(10)])
+        db.session.commit()
+
+    client = login(app.test_client(), 'student0')
+    wanted = [f'Course {c}' for c in range(6)]
+    print(f"{'preferences':<36} {'mean ms':>8} {'p99 ms':>8} {'schedules':>10}")
+    for label, options in (('none', {}),
+                           ('prefer earliest', {'prefer': 'earliest'}),
+                           ('prefer latest, Friday free', {'prefer': 'latest', 'free_days': ['F']}),
+                           ('Friday + Monday free, limit 20', {'free_days': ['M', 'F'], 'limit': 20})):
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            response = client.post('/api/schedule', json=dict(options, courses=wanted))
+            samples.append((time.perf_counter() - start) * 1000)
+        found = len(response.get_json().get('schedules', []))
+        print(f'{label:<36} {sum(samples) / runs:>8.1f} {percentile(samples, 99):>8.1f} {found:>10}')
+
+
+@benchmark
+def fits_schedule_filter(runs=3):
+    """'Fits my schedule' catalog filter over 100k courses: Python parsing vs SQL on course_meetings"""
+    seed(courses=100000, teachers=1000, students=2000, enrollments_per_course=1)
+    with app.app_context():
+        start = time.perf_counter()
+        backfill_course_meetings()
+        print(f'backfilled meeting times in {time.perf_counter() - start:.1f}s')
+
+        student_id = 1000 + 1  #first student
+        def python_filter():
+            mine = [t for (t,) in db.session.execute(
+                db.select(Course.time).join(Enrollment).where(Enrollment.student_id == student_id))]
+            return [course for course in load_course_catalog()
+                    if not any(has_time_conflict(course.time, other) for other in mine)]
+
+        def sql_filter():
+            return load_course_catalog(fits_student_id=student_id)
+
+        print(f"{'approach':<40} {'mean ms':>9} {'courses':>9}")
+        for label, func in (('load all + parse in Python', python_filter),
+                            ('SQL NOT IN over course_meetings', sql_filter)):
+            func()
+            begin = time.perf_counter()
+            for _ in range(runs):
+                result = func()
+            print(f'{label:<40} {(time.perf_counter() - begin) / runs * 1000:>9.1f} {len(result):>9}')
+
+
+@benchmark
+def catalog_audit():
+    """Full catalog audit (sweep-line instructor clashes, bad times, capacity) over 100k courses"""
+    seed(courses=100000, teachers=5000, students=5000, enrollments_per_course=2)
+    with app.app_context():
+        db.session.execute(db.update(Course).where(Course.id % 1000 == 0).values(time='TBA'))
+        db.session.execute(db.update(Course).where(Course.id % 997 == 0).values(capacity=1))
+        db.session.commit()
+        start = time.perf_counter()
+        report = audit_catalog()
+        elapsed = time.perf_counter() - start
+    print(f"audited {report['courses_checked']} courses in {elapsed:.2f}s: "
+          f"{len(report['instructor_clashes'])} clashes, {len(report['unparseable_times'])} unparseable, "
+          f"{len(report['over_capacity'])} over capacity")
+
+
+def measure_allocations(func, runs=3):
+    """Return (peak KiB allocated during one call, KiB still held by its result, mean ms) for func()"""
+    import gc
+    import tracemalloc
+    func()  #warm up statement caches
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return (peak - before) / 1024, (current - before) / 1024, sum(timings) / runs * 1000
+
+
+@benchmark
+def read_models():
+    """Per-request allocations (tracemalloc) for a 500-student roster and a 10k-course catalog: ORM/dicts vs slotted read models"""
+    def orm_roster(course_id):
+        #the course page before read models: hydrate Enrollments, lazy-load each student
+        return [{'enrollment_id': e.id, 'student_name': e.student.full_name, 'grade': e.grade}
+                for e in Enrollment.query.filter_by(course_id=course_id).all()]
+
+    def dict_catalog(enrolled_ids):
+        #the student dashboard before read models: one dict per course, copied per request with its flag
+        rows = db.session.execute(
+            db.select(Course.id, Course.course_name, User.full_name, Course.time, Course.capacity,
+                      db.func.count(Enrollment.id))
+            .join(User, Course.teacher_id == User.id)
+            .outerjoin(Enrollment, Enrollment.course_id == Course.id)
+            .group_by(Course.id).order_by(Course.id))
+        catalog = [{'id': i, 'course_name': n, 'teacher': t, 'time': tm, 'capacity': cap,
+                    'enrolled': e, 'is_full': e >= cap} for i, n, t, tm, cap, e in rows]
+        by_id = {c['id']: c for c in catalog}
+        mine = [by_id[cid] for cid in enrolled_ids if cid in by_id]
+        return catalog, mine, [dict(c, is_enrolled=c['id'] in enrolled_ids) for c in catalog]
+
+    def read_model_catalog(enrolled_ids):
+        catalog = load_course_catalog()
+        order = {cid: i for i, cid in enumerate(enrolled_ids)}
+        return catalog, sorted((c for c in catalog if c.id in order), key=lambda c: order[c.id])
+
+    print(f"{'workload':<28} {'approach':<26} {'peak KiB':>9} {'held KiB':>9} {'mean ms':>8}")
+    seed(courses=1, teachers=1, students=500, enrollments_per_course=500)
+    with app.app_context():
+        for label, func in (('ORM + dicts', lambda: orm_roster(1)),
+                            ('slotted RosterEntry', lambda: load_roster(1))):
+            db.session.expunge_all()
+            peak, held, ms = measure_allocations(lambda: (db.session.expunge_all(), func())[1])
+            print(f"{'roster, 500 students':<28} {label:<26} {peak:>9.0f} {held:>9.0f} {ms:>8.1f}")
+
+    seed(courses=10000, teachers=200, students=500, enrollments_per_course=2)
+    with app.app_context():
+        enrolled = [1, 5, 9]
+        for label, func in (('dicts + per-request copy', lambda: dict_catalog(enrolled)),
+                            ('slotted CourseSummary', lambda: read_model_catalog(enrolled))):
+            peak, held, ms = measure_allocations(func)
+            print(f"{'catalog, 10k courses':<28} {label:<26} {peak:>9.0f} {held:>9.0f} {ms:>8.1f}")
+
+
+@benchmark
+def term_archive(runs=20, past_terms=('Fall 2023', 'Spring 2024', 'Fall 2024', 'Spring 2025'),
+                 courses_per_term=1000, enrollments_per_course=500):
+    """Hot-route latency as closed terms pile up (500k enrollments each), left in place vs archived"""
+    seed(courses=1000, teachers=100, students=5000, enrollments_per_course=20)
+    client = login(app.test_client(), 'student0')
+
+    def mean_ms(func):
+        func()
+        start = time.perf_counter()
+        for _ in range(runs):
+            func()
+        return (time.perf_counter() - start) / runs * 1000
+
+    def dashboard():
+        cache.clear()  #measure the catalog query, not the cache
+        fragment_cache.clear()
+        client.get('/student/dashboard').close()
+
+    def enroll_cycle():
+        client.post('/api/enroll', json={'course_id': 999})
+        client.post('/api/unenroll', json={'course_id': 999})
+
+    def enrollment_count():
+        with app.app_context():
+            db.session.scalar(db.select(db.func.count(Enrollment.id)))
+
+    print(f"{'history rows':>12} {'layout':<10} {'dashboard ms':>13} {'enroll+drop ms':>15} {'COUNT(*) ms':>12} {'archive s':>10}")
+    history = 0
+    for term in (None,) + tuple(past_terms):
+        archived_s = ''
+        if term is not None:
+            with app.app_context():
+                db.session.execute(db.insert(Course), [{
+                    'course_name': f'Old {c}', 'teacher_id': 1 + c % 100, 'time': course_time(c),
+                    'capacity': enrollments_per_course, 'term': term} for c in range(courses_per_term)])
+                #courses use AUTOINCREMENT, so archived ids are never handed out again
+                first_id = db.session.scalar(db.select(db.func.min(Course.id)).where(Course.term == term))
+                db.session.execute(db.insert(Enrollment), [{
+                    'student_id': 101 + (c * enrollments_per_course + k) % 5000, 'course_id': first_id + c,
+                    'grade': float(k % 100)} for c in range(courses_per_term) for k in range(enrollments_per_course)])
+                db.session.commit()
+            history += courses_per_term * enrollments_per_course
+            row = [mean_ms(dashboard), mean_ms(enroll_cycle), mean_ms(enrollment_count)]
+            print(f'{history:>12} {"in place":<10} {row[0]:>13.1f} {row[1]:>15.1f} {row[2]:>12.1f} {"":>10}')
+            with app.app_context():
+                start = time.perf_counter()
+                archive_term(term)
+                archived_s = f'{time.perf_counter() - start:.1f}'
+        row = [mean_ms(dashboard), mean_ms(enroll_cycle), mean_ms(enrollment_count)]
+        print(f'{history:>12} {"archived":<10} {row[0]:>13.1f} {row[1]:>15.1f} {row[2]:>12.1f} {archived_s:>10}')
+    with app.app_context():
+        print(f'archived enrollments: {db.session.scalar(db.select(db.func.count(ArchivedEnrollment.id)))}')
+
+
+def wait_for_port(port, timeout=15):
+    """Block until a local server accepts connections"""
+    import socket
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+async def http_post_json(port, path, payload, cookie=None, timeout=30):
+    """Minimal HTTP/1.1 JSON POST over a fresh connection; returns (status, headers text)"""
+    import asyncio
+    import json
+    body = json.dumps(payload).encode()
+    head = (f'POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n')
+    if cookie:
+        head += f'Cookie: {cookie}\r\n'
+    async def exchange():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(head.encode() + b'\r\n' + body)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return response
+    response = await asyncio.wait_for(exchange(), timeout)
+    headers = response.split(b'\r\n\r\n', 1)[0].decode('latin-1')
+    return int(headers.split(' ', 2)[1]), headers
+
+
+async def fire(concurrency, port, path, payload, cookie=None):
+    """Send `concurrency` simultaneous requests; returns (latencies ms, error count)"""
+    import asyncio
+    async def one():
+        start = time.perf_counter()
+        try:
+            status, _ = await http_post_json(port, path, payload, cookie)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            return None
+        return (time.perf_counter() - start) * 1000 if status == 200 else None
+    results = await asyncio.gather(*(one() for _ in range(concurrency)))
+    latencies = [r for r in results if r is not None]
+    return latencies, len(results) - len(latencies)
+
+
+@benchmark
+def async_serving(levels=(50, 200, 1000)):
+    """Threaded WSGI dev server vs uvicorn + asgi.py: p99 and errors for concurrent logins and grade updates"""
+    import asyncio
+    import subprocess
+    seed(courses=200, teachers=20, students=2000, enrollments_per_course=10)
+
+    servers = (
+        ('werkzeug threaded (WSGI)', 5101,
+         [sys.executable, '-c', 'from app import app; app.run(port=5101, threaded=True)']),
+        ('uvicorn (asgi.py)', 5102,
+         [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', '5102', '--log-level', 'error']),
+    )
+    print(f"{'server':<26} {'request':<14} {'concurrency':>11} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for label, port, command in servers:
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        try:
+            wait_for_port(port)
+            _, headers = asyncio.run(http_post_json(port, '/login', {'username': 'teacher0', 'password': 'password123'}))
+            cookie = next(line.split(':', 1)[1].split(';')[0].strip()
+                          for line in headers.split('\r\n') if line.lower().startswith('set-cookie'))
+            scenarios = [('login', '/login', {'username': 'student0', 'password': 'password123'}, None, levels[:2]),
+                         ('update_grade', '/api/update_grade', {'enrollment_id': 1, 'grade': 90}, cookie, levels)]
+            for name, path, payload, session_cookie, concurrencies in scenarios:
+                for concurrency in concurrencies:
+                    latencies, errors = asyncio.run(fire(concurrency, port, path, payload, session_cookie))
+                    p50 = percentile(latencies, 50) if latencies else float('nan')
+                    p99 = percentile(latencies, 99) if latencies else float('nan')
+                    print(f'{label:<26} {name:<14} {concurrency:>11} {p50:>8.1f} {p99:>8.1f} {errors:>7}')
+        finally:
+            process.terminate()
+            process.wait()
+
+
+@benchmark
+def online_backup(ballast_mb=2048, idle_seconds=5, journal_modes=('wal', 'delete')):
+    """Roster read and grade write p99 while a multi-GB database is backed up (one step vs incremental)"""
+    import sqlite3
+    import threading
+    seed(courses=2000, teachers=100, students=5000, enrollments_per_course=50)
+    with app.app_context():
+        path = database_path()
+    #pad the file with a throwaway table so the copy takes as long as a real multi-GB backup
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE bench_ballast (id INTEGER PRIMARY KEY, data BLOB)')
+    conn.execute('INSERT INTO bench_ballast (data) WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n '
+                 'WHERE i < ?) SELECT randomblob(4000) FROM n', (ballast_mb * 256,))
+    conn.commit()
+    conn.close()
+    print(f'database: {os.path.getsize(path) / 2 ** 20:.0f} MiB')
+    client = login(app.test_client(), 'teacher0')
+
+    def foreground(still_running):
+        reads, writes, errors = [], [], 0
+        while still_running():
+            for samples, call in ((reads, lambda: client.get('/teacher/course/1')),
+                                  (writes, lambda: client.post('/api/update_grade', json={'enrollment_id': 1, 'grade': len(writes) % 100}))):
+                start = time.perf_counter()
+                response = call()
+                samples.append((time.perf_counter() - start) * 1000)
+                errors += response.status_code != 200
+                response.close()
+        return reads, writes, errors
+
+    print(f"{'journal':<8} {'backup':<12} {'seconds':>8} {'restarts':>9} {'read p50':>9} {'read p99':>9} "
+          f"{'write p99':>10} {'errors':>7}")
+    target = os.path.join(_workdir, 'backup.db')
+    scenarios = [(mode, label, pages, pause) for mode in journal_modes
+                 for label, pages, pause in (('none', None, None), ('one step', -1, 0),
+                                             ('incremental', app.config['BACKUP_PAGES'], app.config['BACKUP_PAUSE']))]
+    for mode, label, pages, pause in scenarios:
+        if mode != app.config['SQLITE_JOURNAL_MODE']:
+            app.config['SQLITE_JOURNAL_MODE'] = mode
+            with app.app_context():
+                db.engine.dispose()
+            conn = sqlite3.connect(path)
+            conn.execute(f'PRAGMA journal_mode={mode}')
+            conn.close()
+        result = {}
+        if pages is None:
+            deadline = time.monotonic() + idle_seconds
+            reads, writes, errors = foreground(lambda: time.monotonic() < deadline)
+        else:
+            def run():
+                with app.app_context():
+                    result.update(backup_database(target, pages=pages, pause=pause))
+            thread = threading.Thread(target=run)
+            thread.start()
+            reads, writes, errors = foreground(thread.is_alive)
+            thread.join()
+            os.remove(target)
+        print(f"{mode:<8} {label:<12} {result.get('seconds', idle_seconds):>8.1f} {result.get('restarts', 0):>9} "
+              f"{percentile(reads, 50):>9.1f} {percentile(reads, 99):>9.1f} {percentile(writes, 99):>10.1f} {errors:>7}")
+
+
+def seat_reader(course_ids, seconds, results):
+    """One worker process reading availability from the shared seat map"""
+    reads = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for course_id in course_ids:
+            seat_map.is_full(course_id)
+        reads += len(course_ids)
+    results.put(reads)
+
+
+@benchmark
+def seat_map_reads(courses=10000, seconds=3, processes=(1, 4)):
+    """Seat availability reads per second: database per check vs the shared seat map"""
+    import multiprocessing
+    import random
+    seed(courses=courses, teachers=100, students=5000, enrollments_per_course=20)
+    course_ids = random.Random(7).choices(range(1, courses + 1), k=1000)
+    print(f"{'source':<28} {'processes':>9} {'reads/s':>12}")
+    with app.app_context():
+        reads = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for course_id in course_ids[:100]:
+                db.session.get(Course, course_id).is_full()
+            reads += 100
+            db.session.expunge_all()
+        print(f"{'database (Course.is_full)':<28} {1:>9} {reads / seconds:>12.0f}")
+
+        seat_map.clear()
+        start = time.perf_counter()
+        seat_map.load()
+        load_ms = (time.perf_counter() - start) * 1000
+    for count in processes:
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=seat_reader, args=(course_ids, seconds, results)) for _ in range(count)]
+        for worker in workers:
+            worker.start()
+        total = sum(results.get() for _ in workers)
+        for worker in workers:
+            worker.join()
+        print(f"{'seat map':<28} {count:>9} {total / seconds:>12.0f}")
+    with app.app_context():
+        start = time.perf_counter()
+        report = check_seat_map()
+        check_ms = (time.perf_counter() - start) * 1000
+    print(f'seat map load: {load_ms:.0f} ms, consistency check: {check_ms:.0f} ms, '
+          f"{len(report['mismatches'])} mismatches over {report['courses']} courses")
+
+
+def shard_writer(urls, course_ids, first_student, deadline, results):
+    """One writer process: enroll a fresh student per operation until the deadline"""
+    router = ShardRouter(urls)
+    done = errors = 0
+    student_id = first_student
+    while time.monotonic() < deadline:
+        try:
+            router.enroll(student_id, course_ids[student_id % len(course_ids)])
+            done += 1
+        except Exception:
+            errors += 1
+        student_id += 1
+    results.put((done, errors))
+
+
+@benchmark
+def sharded_writes(shard_counts=(1, 2, 4), writers=8, seconds=5, courses=64):
+    """Enrollment write throughput with 8 writer processes as the shard count grows"""
+    import multiprocessing
+    with app.app_context():
+        seed(courses=courses, teachers=8, students=10, enrollments_per_course=0)
+        Course.query.update({Course.capacity: 10 ** 9})
+        db.session.commit()
+    print(f"{'shards':>6} {'writes':>8} {'writes/s':>9} {'errors':>7}")
+    for count in shard_counts:
+        urls = [f'sqlite:///{_workdir}/shards{count}_{k}.db' for k in range(count)]
+        with app.app_context():
+            ShardRouter(urls).copy_from_main()
+        results = multiprocessing.Queue()
+        deadline = time.monotonic() + seconds
+        processes = [multiprocessing.Process(target=shard_writer,
+                                             args=(urls, list(range(1, courses + 1)), 1000 + w * 10 ** 6, deadline, results))
+                     for w in range(writers)]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        done = sum(d for d, _ in totals)
+        errors = sum(e for _, e in totals)
+        print(f'{count:>6} {done:>8} {done / seconds:>9.0f} {errors:>7}')
+
+
+@benchmark
+def term_rollover(courses=20000, per_course_sample=500):
+    """Cloning a 20k-course term: one admin form commit per course vs rollover_term (with a 20k-row CSV)"""
+    import io
+    seed(courses=courses, teachers=400, students=1000, enrollments_per_course=2)
+    fall = app.config['CURRENT_TERM']
+    with app.app_context():
+        backfill_course_meetings()
+        seat_map.clear()
+        seat_map.load()
+        print(f"{'method':<36} {'courses':>8} {'seconds':>8}")
+
+        #what CourseAdmin does per submit: one ORM insert (meetings synced on flush) and one commit
+        source = db.session.execute(db.select(Course.course_name, Course.teacher_id, Course.time, Course.capacity)
+                                    .limit(per_course_sample)).all()
+        start = time.perf_counter()
+        for name, teacher_id, meets, capacity in source:
+            db.session.add(Course(course_name=name, teacher_id=teacher_id, time=meets, capacity=capacity,
+                                  term='Winter 2026'))
+            db.session.commit()
+        seconds = time.perf_counter() - start
+        print(f"{'per-course ORM commits':<36} {per_course_sample:>8} {seconds:>8.2f}")
+        print(f"{'  extrapolated':<36} {courses:>8} {seconds * courses / per_course_sample:>8.1f}")
+
+        for label, target, csv_text in (
+                ('rollover_term', 'Spring 2026', None),
+                ('rollover_term + CSV adjustments', 'Summer 2026',
+                 'course_id,capacity,time\n' + ''.join(f'{i},{20 + i % 7},{course_time(i + 3)}\n'
+                                                       for i in range(1, courses + 1))),
+                ('re-run (all skipped)', 'Spring 2026', None)):
+            start = time.perf_counter()
+            adjustments = parse_rollover_csv(io.StringIO(csv_text)) if csv_text else None
+            rolled = rollover_term(fall, target, adjustments=adjustments)
+            print(f"{label:<36} {rolled['cloned']:>8} {time.perf_counter() - start:>8.2f}")
+        start = time.perf_counter()
+        report = audit_catalog()
+        print(f"audit of {report['courses_checked']} courses after rollover: {time.perf_counter() - start:.1f} s, "
+              f"{len(report['unparseable_times'])} unparseable times")
+
+
+@benchmark
+def session_overhead(requests=3000):
+    """Per-request cost of the session: signed cookie vs server-side store (front-cache hit and miss)"""
+    from flask.sessions import SecureCookieSessionInterface
+    seed(courses=10, teachers=2, students=10, enrollments_per_course=1)
+
+    def mean_us(miss=False):
+        client = login(app.test_client(), 'admin')
+        client.get('/admin/cache/stats')
+        start = time.perf_counter()
+        for _ in range(requests):
+            if miss:
+                session_cache.clear()
+            client.get('/admin/cache/stats')
+        return (time.perf_counter() - start) / requests * 1e6
+
+    print(f"{'session':<34} {'us/request':>11}")
+    for label, interface, miss in (('signed cookie (previous)', SecureCookieSessionInterface(), False),
+                                   ('server-side, front-cache hit', ServerSessionInterface(), False),
+                                   ('server-side, front-cache miss', ServerSessionInterface(), True)):
+        app.session_interface = interface
+        print(f'{label:<34} {mean_us(miss):>11.1f}')
+    app.session_interface = ServerSessionInterface()
+
+
+@benchmark
+def event_log_overhead(requests=1000):
+    """Mean /api/enroll + /api/unenroll time with the event log off, batched and strict"""
+    import app as app_module
+    seed(courses=10, teachers=2, students=10, enrollments_per_course=1)
+    previous = app_module.event_log
+
+    print(f"{'event log':<12} {'us/request':>11} {'events':>8} {'flushes':>8}")
+    for mode in ('off', 'batched', 'strict'):
+        log = app_module.event_log = EventLog(tempfile.mkdtemp(prefix='acme-bench-events-', dir=_workdir), mode=mode)
+        client = login(app.test_client(), 'student0')
+        start = time.perf_counter()
+        for _ in range(requests // 2):
+            assert client.post('/api/enroll', json={'course_id': 2}).status_code == 200
+            assert client.post('/api/unenroll', json={'course_id': 2}).status_code == 200
+        elapsed = time.perf_counter() - start
+        log.flush()
+        stats = log.stats()
+        print(f'{mode:<12} {elapsed / requests * 1e6:>11.1f} {stats["appended"]:>8} {stats["flushes"]:>8}')
+    app_module.event_log = previous
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] == '--list':
+        for name, func in BENCHMARKS.items():
+            print(f'{name:<28} {func.__doc__}')
+        return 0
+    for name in argv[1:]:
+        if name not in BENCHMARKS:
+            print(f'Unknown benchmark: {name}')
+            return 1
+        print(f'== {name}: {BENCHMARKS[name].__doc__}')
+        BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,53 @@
+"""
+Shared pytest setup for the ACME University Enrollment System
+Every test gets a fresh in-memory SQLite database and the Flask test client, so no server is needed
+and test modules can run in parallel:  python -m pytest -n auto
+"""
+
+import os
+import tempfile
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ.setdefault('EVENT_LOG_DIR', tempfile.mkdtemp(prefix='acme-test-events-'))
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import app, db, cache, fragment_cache, ownership_cache, seat_map, session_cache
+
+#one cheap hash per password: login still runs check_password_hash, without scrypt's cost per user
+FAST_PASSWORD_HASHES = {password: generate_password_hash(password, method='pbkdf2:sha256:1')
+                        for password in ('password123', 'admin123')}
+
+
+@pytest.fixture
+def database():
+    """
+    Returns seed(load): recreate the schema, run load() to add rows, commit, and reset every cache
+    Tests then run inside an app context
+    """
+    app.config['TESTING'] = True
+
+    def seed(load):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            load()
+            db.session.commit()
+            seat_map.clear()
+            seat_map.load()
+        cache.clear()
+        fragment_cache.clear()
+        ownership_cache.clear()
+        session_cache.clear()
+
+    with app.app_context():
+        yield seed
+
+
+@pytest.fixture
+def sample_client(database):
+    """Test client over the init_db.py sample data (the Excel enrollment data)"""
+    from init_db import load_sample_data
+    database(lambda: load_sample_data(FAST_PASSWORD_HASHES.__getitem__))
+    return app.test_client()
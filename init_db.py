@@ -3,7 +3,88 @@ Database initialization script for ACME University Enrollment System
 This script creates sample users, courses, and enrollments matching the Excel data
 """
 
-from app import app, db, User, Course, Enrollment
+from werkzeug.security import generate_password_hash
+
+from app import app, db, seat_map, User, Course, Enrollment
+
+#sample data - matching Excel data
+#(username, full name, role, password)
+SAMPLE_USERS = [
+    #students
+    ('jsantos', 'Jose Santos', 'student', 'password123'),
+    ('bbrown', 'Betty Brown', 'student', 'password123'),
+    ('jstuart', 'John Stuart', 'student', 'password123'),
+    ('lcheng', 'Li Cheng', 'student', 'password123'),
+    ('nlittle', 'Nancy Little', 'student', 'password123'),
+    ('mnorris', 'Mindy Norris', 'student', 'password123'),
+    ('aranganath', 'Aditya Ranganath', 'student', 'password123'),
+    ('ychen', 'Yi Wen Chen', 'student', 'password123'),
+    #teachers
+    ('ahepworth', 'Ammon Hepworth', 'teacher', 'password123'),
+    ('swalker', 'Susan Walker', 'teacher', 'password123'),
+    ('rjenkins', 'Ralph Jenkins', 'teacher', 'password123'),
+    #admin
+    ('admin', 'System Administrator', 'admin', 'admin123'),
+]
+
+#(course name, instructor username, time, capacity)
+SAMPLE_COURSES = [
+    ('Math 101', 'rjenkins', 'MWF 10:00-10:50 AM', 8),
+    ('Physics 121', 'swalker', 'TR 11:00-11:50 AM', 10),
+    ('CS 106', 'ahepworth', 'MWF 2:00-2:50 PM', 10),
+    ('CS 162', 'ahepworth', 'TR 3:00-3:50 PM', 4),
+]
+
+#(student username, course name, grade)
+SAMPLE_ENROLLMENTS = [
+    # Math 101 enrollments
+    ('jsantos', 'Math 101', 92.0),
+    ('bbrown', 'Math 101', 65.0),
+    ('jstuart', 'Math 101', 86.0),
+    ('lcheng', 'Math 101', 77.0),
+    # Physics 121 enrollments
+    ('nlittle', 'Physics 121', 53.0),
+    ('lcheng', 'Physics 121', 85.0),
+    ('mnorris', 'Physics 121', 94.0),
+    ('jstuart', 'Physics 121', 91.0),
+    ('bbrown', 'Physics 121', 88.0),
+    # CS 106 enrollments
+    ('aranganath', 'CS 106', 93.0),
+    ('ychen', 'CS 106', 85.0),
+    ('nlittle', 'CS 106', 57.0),
+    ('mnorris', 'CS 106', 68.0),
+    # CS 162 enrollments (at capacity 4/4)
+    ('aranganath', 'CS 162', 99.0),
+    ('nlittle', 'CS 162', 87.0),
+    ('ychen', 'CS 162', 92.0),
+    ('jstuart', 'CS 162', 67.0),
+]
+
+
+def load_sample_data(hash_password=generate_password_hash):
+    """
+    Add the sample users, courses and enrollments to the current session (the caller commits)
+    Each distinct password is hashed once, so tests can pass a cheap hash function
+    """
+    hashes = {}
+    for password in {password for _, _, _, password in SAMPLE_USERS}:
+        hashes[password] = hash_password(password)
+
+    users = {username: User(username=username, full_name=full_name, role=role, password_hash=hashes[password])
+             for username, full_name, role, password in SAMPLE_USERS}
+    db.session.add_all(users.values())
+    db.session.flush()
+
+    courses = {name: Course(course_name=name, teacher_id=users[teacher].id, time=time, capacity=capacity)
+               for name, teacher, time, capacity in SAMPLE_COURSES}
+    db.session.add_all(courses.values())
+    db.session.flush()
+
+    db.session.execute(db.insert(Enrollment), [
+        {'student_id': users[student].id, 'course_id': courses[course].id, 'grade': grade}
+        for student, course, grade in SAMPLE_ENROLLMENTS
+    ])
+
 
 def init_database():
     """Initialize database with sample data from Excel file"""
@@ -16,122 +97,11 @@ def init_database():
         print("Creating tables...")
         db.create_all()
 
-        #create users (students, teachers, admin)
-        print("Creating users...")
-
-        #students - matching Excel data
-        student1 = User(username='jsantos', full_name='Jose Santos', role='student')
-        student1.set_password('password123')
-
-        student2 = User(username='bbrown', full_name='Betty Brown', role='student')
-        student2.set_password('password123')
-
-        student3 = User(username='jstuart', full_name='John Stuart', role='student')
-        student3.set_password('password123')
-
-        student4 = User(username='lcheng', full_name='Li Cheng', role='student')
-        student4.set_password('password123')
-
-        student5 = User(username='nlittle', full_name='Nancy Little', role='student')
-        student5.set_password('password123')
-
-        student6 = User(username='mnorris', full_name='Mindy Norris', role='student')
-        student6.set_password('password123')
-
-        student7 = User(username='aranganath', full_name='Aditya Ranganath', role='student')
-        student7.set_password('password123')
-
-        student8 = User(username='ychen', full_name='Yi Wen Chen', role='student')
-        student8.set_password('password123')
-
-        #teachers
-        teacher1 = User(username='ahepworth', full_name='Ammon Hepworth', role='teacher')
-        teacher1.set_password('password123')
-
-        teacher2 = User(username='swalker', full_name='Susan Walker', role='teacher')
-        teacher2.set_password('password123')
-
-        teacher3 = User(username='rjenkins', full_name='Ralph Jenkins', role='teacher')
-        teacher3.set_password('password123')
-
-        #admin
-        admin = User(username='admin', full_name='System Administrator', role='admin')
-        admin.set_password('admin123')
-
-        #add all users to session
-        db.session.add_all([
-            student1, student2, student3, student4, student5, student6, student7, student8,
-            teacher1, teacher2, teacher3, admin
-        ])
-        db.session.commit()
-
-        #create courses - matching Excel data
-        print("Creating courses...")
-
-        course1 = Course(
-            course_name='Math 101',
-            teacher_id=teacher3.id,
-            time='MWF 10:00-10:50 AM',
-            capacity=8
-        )
-
-        course2 = Course(
-            course_name='Physics 121',
-            teacher_id=teacher2.id,
-            time='TR 11:00-11:50 AM',
-            capacity=10
-        )
-
-        course3 = Course(
-            course_name='CS 106',
-            teacher_id=teacher1.id,
-            time='MWF 2:00-2:50 PM',
-            capacity=10
-        )
-
-        course4 = Course(
-            course_name='CS 162',
-            teacher_id=teacher1.id,
-            time='TR 3:00-3:50 PM',
-            capacity=4
-        )
-
-        db.session.add_all([course1, course2, course3, course4])
-        db.session.commit()
-
-        #create enrollments - matching Excel data exactly
-        print("Creating enrollments...")
-
-        # Math 101 enrollments
-        e1 = Enrollment(student_id=student1.id, course_id=course1.id, grade=92.0)  # Jose Santos
-        e2 = Enrollment(student_id=student2.id, course_id=course1.id, grade=65.0)  # Betty Brown
-        e3 = Enrollment(student_id=student3.id, course_id=course1.id, grade=86.0)  # John Stuart
-        e4 = Enrollment(student_id=student4.id, course_id=course1.id, grade=77.0)  # Li Cheng
-
-        # Physics 121 enrollments
-        e5 = Enrollment(student_id=student5.id, course_id=course2.id, grade=53.0)  # Nancy Little
-        e6 = Enrollment(student_id=student4.id, course_id=course2.id, grade=85.0)  # Li Cheng
-        e7 = Enrollment(student_id=student6.id, course_id=course2.id, grade=94.0)  # Mindy Norris
-        e8 = Enrollment(student_id=student3.id, course_id=course2.id, grade=91.0)  # John Stuart
-        e9 = Enrollment(student_id=student2.id, course_id=course2.id, grade=88.0)  # Betty Brown
-
-        # CS 106 enrollments
-        e10 = Enrollment(student_id=student7.id, course_id=course3.id, grade=93.0)  # Aditya Ranganath
-        e11 = Enrollment(student_id=student8.id, course_id=course3.id, grade=85.0)  # Yi Wen Chen
-        e12 = Enrollment(student_id=student5.id, course_id=course3.id, grade=57.0)  # Nancy Little
-        e13 = Enrollment(student_id=student6.id, course_id=course3.id, grade=68.0)  # Mindy Norris
-
-        # CS 162 enrollments (at capacity 4/4)
-        e14 = Enrollment(student_id=student7.id, course_id=course4.id, grade=99.0)  # Aditya Ranganath
-        e15 = Enrollment(student_id=student5.id, course_id=course4.id, grade=87.0)  # Nancy Little
-        e16 = Enrollment(student_id=student8.id, course_id=course4.id, grade=92.0)  # Yi Wen Chen
-        e17 = Enrollment(student_id=student3.id, course_id=course4.id, grade=67.0)  # John Stuart
-
-        db.session.add_all([
-            e1, e2, e3, e4, e5, e6, e7, e8, e9, e10,
-            e11, e12, e13, e14, e15, e16, e17
-        ])
+        print("Creating users, courses and enrollments...")
+        load_sample_data()
         db.session.commit()
+        #the shared seat map still describes the old tables; running servers reload it on their next read
+        seat_map.clear()
 
         print("\n" + "="*60)
         print("Database initialized successfully!")